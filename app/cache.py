@@ -0,0 +1,84 @@
+from collections import OrderedDict
+import time
+
+
+class TTLCache:
+    """
+    Bounded in-process LRU cache where every entry also expires after a fixed time-to-live.
+
+    Each gunicorn worker holds its own instance, so entries are only ever as fresh as the TTL across workers.
+    """
+    def __init__(self, maxsize: int, ttl: int, timer=time.monotonic):
+        """
+        :param maxsize: maximum number of entries kept, the least recently used entry is evicted beyond that
+        :param ttl: number of seconds an entry stays valid after it was set
+        :param timer: clock used for expiry, useful when testing
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        """ Returns the cached value for key, or default if it is missing or expired """
+        try:
+            expires_on, value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        if expires_on <= self.timer():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """ Caches value for key, evicting the least recently used entries if full """
+        self._data[key] = (self.timer() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """ Removes key from the cache and returns its value if it was still valid """
+        try:
+            expires_on, value = self._data.pop(key)
+        except KeyError:
+            return default
+        return value if expires_on > self.timer() else default
+
+    def expire(self) -> int:
+        """
+        Removes all expired entries, which otherwise only go once they are looked up or evicted.
+
+        :return: number of entries removed
+        """
+        now = self.timer()
+        expired = [key for key, (expires_on, _) in self._data.items() if expires_on <= now]
+        for key in expired:
+            del self._data[key]
+        return len(expired)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        """ :return: counters suitable for reporting as metrics """
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data and self._data[key][0] > self.timer()
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+
+from aiohttp import web
+import psycopg2
+
+from .metrics import Histogram
+
+log = logging.getLogger(__name__)
+
+
+def blocking_connection(settings):
+    """
+    :param settings: settings including connection settings
+    :return: blocking psycopg2 connection for management commands and work done in executors, e.g. COPY which
+             aiopg does not support
+    """
+    return psycopg2.connect(
+        dbname=settings.DB_NAME,
+        password=settings.DB_PASSWORD,
+        host=settings.DB_HOST,
+        port=settings.DB_PORT,
+        user=settings.DB_USER,
+    )
+
+
+class PoolTimeout(Exception):
+    """ Raised when no pooled connection became free within the acquire timeout """
+
+
+class MonitoredEngine:
+    """
+    Wraps an aiopg engine so that acquiring a connection gives up after a timeout and pool usage is tracked.
+
+    Anything else is passed through to the wrapped engine.
+    """
+    def __init__(self, engine, acquire_timeout: float):
+        """
+        :param engine: aiopg.sa engine to acquire connections from
+        :param acquire_timeout: number of seconds to wait for a free connection before raising PoolTimeout
+        """
+        self.engine = engine
+        self.acquire_timeout = acquire_timeout
+        self.waiters = 0
+        self.timeouts = 0
+        self.acquire_wait = Histogram()
+
+    def acquire(self):
+        """ Acquire a connection, use as `async with engine.acquire() as conn:` """
+        return _AcquireContextManager(self)
+
+    async def _acquire(self):
+        self.waiters += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(self.engine.acquire(), self.acquire_timeout)
+
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise PoolTimeout('no database connection free after {}s ({} waiting)'.format(
+                self.acquire_timeout, self.waiters))
+
+        finally:
+            self.waiters -= 1
+            self.acquire_wait.observe(time.perf_counter() - start)
+
+    def release(self, conn):
+        return self.engine.release(conn)
+
+    def stats(self) -> dict:
+        """ :return: pool usage suitable for reporting as metrics """
+        return {
+            'size': self.engine.size,
+            'maxsize': self.engine.maxsize,
+            'in_use': self.engine.size - self.engine.freesize,
+            'free': self.engine.freesize,
+            'waiters': self.waiters,
+            'timeouts': self.timeouts,
+            'acquire_wait': self.acquire_wait.stats(),
+        }
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+
+class _AcquireContextManager:
+    def __init__(self, engine):
+        self.engine = engine
+        self.conn = None
+
+    def __await__(self):
+        return self.engine._acquire().__await__()
+
+    async def __aenter__(self):
+        self.conn = await self.engine._acquire()
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.engine.release(self.conn)
+        self.conn = None
+
+
+class TimedConnection:
+    """
+    Wraps an aiopg.sa connection to add up the number of statements executed and the time spent on them.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.queries = 0
+        self.db_time = 0
+
+    async def execute(self, query, *multiparams, **params):
+        start = time.perf_counter()
+        try:
+            return await self.conn.execute(query, *multiparams, **params)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+class RequestConnection:
+    """
+    Connection shared by everything that handles a single request, acquired from the pool on first use.
+
+    It keeps count of the statements executed and the time spent on them, even across early releases.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.conn = None
+        self.queries = 0
+        self.db_time = 0
+
+    async def get(self):
+        if self.conn is None:
+            self.conn = TimedConnection(await self.engine.acquire())
+        return self.conn
+
+    async def release(self):
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            self.queries += conn.queries
+            self.db_time += conn.db_time
+            await self.engine.release(conn.conn)
+
+
+class _RequestConnectionContextManager:
+    def __init__(self, request_connection):
+        self.request_connection = request_connection
+
+    async def __aenter__(self):
+        return await self.request_connection.get()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # released by request_connection_middleware once the response is ready
+        pass
+
+
+def connection(request):
+    """
+    Connection of the request, use as `async with connection(request) as conn:`.
+
+    :param request: request handled within request_connection_middleware
+    """
+    return _RequestConnectionContextManager(request['pg_conn'])
+
+
+async def release_connection(request):
+    """
+    Return the request's connection to the pool early, e.g. before slow work that needs no database.
+    It is acquired again if used afterwards.
+    """
+    await request['pg_conn'].release()
+
+
+async def request_connection_middleware(app, handler):
+    """ Gives every request one lazily acquired connection, released when its response is ready """
+    async def middleware(request):
+        request['pg_conn'] = RequestConnection(app['pg_engine'])
+        try:
+            return await handler(request)
+        finally:
+            await request['pg_conn'].release()
+    return middleware
+
+
+async def pool_timeout_middleware(app, handler):
+    """ Answers 503 right away when the database pool is exhausted instead of letting requests queue up """
+    async def middleware(request):
+        try:
+            return await handler(request)
+        except PoolTimeout as e:
+            log.warning(e)
+            raise web.HTTPServiceUnavailable(text='We are a little busy right now. Please try again in a moment.')
+    return middleware
+
+
+async def report_pool_stats(engine, interval: int):
+    """ Log pool usage every interval seconds, runs until cancelled """
+    while True:
+        await asyncio.sleep(interval)
+        stats = engine.stats()
+        log.info('db pool: %(in_use)d in use, %(free)d free, %(waiters)d waiting, %(timeouts)d timeouts', stats)
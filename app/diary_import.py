@@ -0,0 +1,181 @@
+"""
+Bulk import of diary entries, e.g. for families migrating from other diary apps.
+
+Entries are parsed as a stream, highlighted in batches and loaded with COPY into a staging table that is merged
+into diary_entries with a single upsert. Like entries saved by Day.post, they are copied into the family feeds of
+the owner's guests and the newest are sent as live updates. All of it is blocking, the import view runs it in an
+executor.
+"""
+import csv
+import datetime
+from itertools import islice
+import json
+
+import psycopg2
+
+from .highlights import highlight_many
+from .live import CHANNEL, entry_message
+from .models import InviteStatus
+
+FORMATS = ('jsonl', 'csv')
+BATCH_SIZE = 1000
+# only the newest imported entries are sent as live updates, guests find the rest in their family feed
+LIVE_ENTRIES = 10
+
+
+class DiaryImportError(ValueError):
+    """ Raised for uploads that can't be parsed, the message is meant for the user """
+
+
+def parse_jsonl(lines):
+    """ Yields (date, moments) of JSON Lines as written by the export, i.e. objects with date and moments """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            yield _parse_date(entry['date']), _check_moments(entry['moments'])
+        except (ValueError, KeyError, TypeError):
+            raise DiaryImportError('Line {} is not a JSON object with a date and moments'.format(number))
+
+
+def parse_csv(lines):
+    """ Yields (date, moments) of CSV rows with date and moments columns, as written by the export """
+    reader = csv.DictReader(lines)
+    for entry in reader:
+        try:
+            yield _parse_date(entry['date']), _check_moments(entry['moments'])
+        except (ValueError, KeyError, TypeError):
+            raise DiaryImportError('Line {} has no valid date and moments'.format(reader.line_num))
+
+
+def _parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _check_moments(value):
+    # e.g. null or a number in JSON, or None for a CSV row that is missing the moments column
+    if not isinstance(value, str):
+        raise TypeError('moments must be text')
+    return value
+
+
+def _copy_field(value: str) -> str:
+    """ Escape value for COPY's text format """
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+# errors of uploads that can't be read, as opposed to errors of the database
+UPLOAD_ERRORS = (DiaryImportError, UnicodeDecodeError, csv.Error)
+
+
+class CopySource:
+    """
+    File-like object for cursor.copy_expert that parses, highlights and encodes entries only as COPY reads them,
+    so memory use stays constant however large the import is.
+
+    psycopg2 replaces exceptions raised by read with a QueryCanceledError, the upload's error is kept in error so
+    that import_diary can raise it instead.
+    """
+    def __init__(self, entries, batch_size: int = BATCH_SIZE):
+        """
+        :param entries: iterator of (date, moments)
+        :param batch_size: number of entries highlighted at a time
+        """
+        self.entries = iter(entries)
+        self.batch_size = batch_size
+        self.rows = 0
+        self.error = None
+        self._buffer = ''
+        self._offset = 0
+
+    def _next_batch(self) -> str:
+        batch = list(islice(self.entries, self.batch_size))
+        if not batch:
+            return ''
+
+        self.rows += len(batch)
+        highlights = highlight_many(moments for _, moments in batch)
+        return ''.join('{}\t{}\t{}\n'.format(date.isoformat(), _copy_field(highlight), _copy_field(moments))
+                       for (date, moments), highlight in zip(batch, highlights))
+
+    def read(self, size: int = -1) -> str:
+        if self._offset >= len(self._buffer):
+            try:
+                self._buffer = self._next_batch()
+            except UPLOAD_ERRORS as e:
+                self.error = e
+                raise
+            self._offset = 0
+
+        if size < 0:
+            size = len(self._buffer)
+        data = self._buffer[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+
+def import_diary(conn, user_id: int, lines, import_format: str, batch_size: int = BATCH_SIZE,
+                 live_updates: bool = False) -> CopySource:
+    """
+    Import diary entries for a user in one transaction, replacing existing entries of the same days.
+
+    :param conn: blocking psycopg2 connection, see db.blocking_connection
+    :param user_id: owner of the imported entries
+    :param lines: iterable of text lines in the given format
+    :param import_format: jsonl or csv
+    :param batch_size: number of entries highlighted at a time
+    :param live_updates: whether to notify the workers of the newest imported entries, see LIVE_UPDATES
+    :return: the consumed CopySource, with the number of rows imported
+    """
+    if import_format not in FORMATS:
+        raise DiaryImportError('Format must be one of: {}'.format(', '.join(FORMATS)))
+    parse = parse_csv if import_format == 'csv' else parse_jsonl
+    source = CopySource(parse(lines), batch_size)
+
+    with conn, conn.cursor() as cur:
+        cur.execute('CREATE TEMP TABLE diary_import ('
+                    '  seq bigserial, created_on date NOT NULL, highlights text NOT NULL, moments text NOT NULL'
+                    ') ON COMMIT DROP')
+        try:
+            cur.copy_expert('COPY diary_import (created_on, highlights, moments) FROM STDIN', source)
+        except psycopg2.Error:
+            if source.error is not None:
+                raise source.error from None
+            raise
+
+        # the last entry wins if a day shows up more than once
+        cur.execute('INSERT INTO diary_entries (id, user_id, created_on, highlights, moments) '
+                    "SELECT nextval('diary_entry_id_seq'), %(user_id)s, created_on, highlights, moments FROM ("
+                    '  SELECT DISTINCT ON (created_on) created_on, highlights, moments '
+                    '  FROM diary_import ORDER BY created_on, seq DESC'
+                    ') AS latest '
+                    'ON CONFLICT ON CONSTRAINT uq_diary_entries_user_id_created_on DO UPDATE '
+                    'SET highlights = excluded.highlights, moments = excluded.moments', {'user_id': user_id})
+
+        cur.execute('DELETE FROM diary_rollups WHERE user_id = %(user_id)s', {'user_id': user_id})
+        cur.execute('INSERT INTO diary_rollups (user_id, year, month, entries) '
+                    'SELECT user_id, extract(year FROM created_on), extract(month FROM created_on), count(*) '
+                    'FROM diary_entries WHERE user_id = %(user_id)s GROUP BY 1, 2, 3', {'user_id': user_id})
+        cur.execute('UPDATE users SET diary_version = diary_version + 1, diary_modified_on = %(now)s '
+                    'WHERE id = %(user_id)s RETURNING family_feed_pull',
+                    {'user_id': user_id, 'now': datetime.datetime.utcnow()})
+        pull = cur.fetchone()
+        # guests of heavy writers pull their entries when reading the feed instead, see family.fan_out
+        if pull is not None and not pull[0]:
+            cur.execute('INSERT INTO family_feed (guest_id, created_on, owner_id, highlights) '
+                        'SELECT i.guest_id, d.created_on, d.user_id, d.highlights '
+                        'FROM diary_entries AS d '
+                        'JOIN diary_invites AS i ON i.user_id = d.user_id AND i.status = %(accepted)s '
+                        'WHERE d.user_id = %(user_id)s AND d.created_on IN (SELECT created_on FROM diary_import) '
+                        'ON CONFLICT (guest_id, created_on, owner_id) DO UPDATE SET highlights = excluded.highlights',
+                        {'user_id': user_id, 'accepted': InviteStatus.Accepted.name})
+
+        if live_updates:
+            cur.execute('SELECT created_on, highlights FROM diary_entries '
+                        'WHERE user_id = %(user_id)s AND created_on IN (SELECT created_on FROM diary_import) '
+                        'ORDER BY created_on DESC LIMIT %(limit)s', {'user_id': user_id, 'limit': LIVE_ENTRIES})
+            for created_on, highlights in reversed(cur.fetchall()):
+                cur.execute('SELECT pg_notify(%s, %s)', (CHANNEL, entry_message(user_id, created_on, highlights)))
+
+    return source
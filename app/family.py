@@ -0,0 +1,188 @@
+"""
+Family sharing: guests with an Accepted diary invite can read the owner's diary pages, and see the highlights their
+family wrote in the family feed.
+
+The feed is written on fan out: Day.post copies highlights into family_feed for every accepted guest with a single
+INSERT ... SELECT. Owners with more than FAMILY_FEED_FANOUT_LIMIT guests are flagged with family_feed_pull instead,
+their guests pull those entries from diary_entries when reading the feed, see queries.family_feed.
+"""
+import datetime
+
+from sqlalchemy import and_, func, literal, or_, select
+from sqlalchemy.dialects.postgresql import insert
+
+from .cache import TTLCache
+from .db import connection
+from .live import notify_invite
+from .models import InviteStatus, sa_diary_entries, sa_diary_invites, sa_family_feed, sa_users
+
+
+async def load_owner_ids(conn, guest_id: int) -> frozenset:
+    """ :return: ids of the users who accepted guest_id into their diary, read from the database """
+    result = await conn.execute(select([sa_diary_invites.c.user_id]).where(and_(
+        sa_diary_invites.c.guest_id == guest_id,
+        sa_diary_invites.c.status == InviteStatus.Accepted,
+    )))
+    return frozenset([row.user_id async for row in result])
+
+
+class FamilyIndex:
+    """
+    Per worker cache of the owners whose diaries a guest may read, so that shared page views don't cost a query each.
+
+    Entries are dropped when an invite of the guest changes status in this worker, other workers see the change once
+    their entry expires after ttl seconds.
+    """
+    def __init__(self, maxsize: int, ttl: int):
+        self.owners = TTLCache(maxsize, ttl)
+
+    async def owner_ids(self, request, guest_id: int) -> frozenset:
+        """ :return: ids of the users who accepted guest_id into their diary """
+        owner_ids = self.owners.get(guest_id)
+        if owner_ids is None:
+            async with connection(request) as conn:
+                owner_ids = await load_owner_ids(conn, guest_id)
+            self.owners.set(guest_id, owner_ids)
+
+        return owner_ids
+
+    async def can_read(self, request, guest_id: int, owner_id: int) -> bool:
+        return bool(guest_id) and (guest_id == owner_id or owner_id in await self.owner_ids(request, guest_id))
+
+    def invalidate(self, guest_id: int):
+        self.owners.pop(guest_id)
+
+    def stats(self) -> dict:
+        return self.owners.stats()
+
+
+async def set_invite_status(request, invite_id: int, user_id: int, status: InviteStatus):
+    """
+    Change the status of an invite, as its guest accepting or declining it, or as its owner revoking it.
+
+    :param invite_id: id of the invite
+    :param user_id: user making the change, the guest of the invite or its owner when declining
+    :param status: new status
+    :return: id of the owner of the invite, or None if there is no such invite the user may change
+    """
+    async with connection(request) as conn:
+        async with conn.begin():
+            result = await conn.execute(invite_status_update(invite_id, user_id, status))
+            invite = await result.first()
+
+            if invite is not None:
+                await update_feed(conn, request.app['settings'], invite.user_id, invite.guest_id, status)
+                if request.app['settings'].LIVE_UPDATES:
+                    await notify_invite(conn, invite.user_id, invite.guest_id, status is InviteStatus.Accepted)
+
+    if invite is None:
+        return None
+
+    request.app['family_index'].invalidate(invite.guest_id)
+    return invite.user_id
+
+
+def invite_status_update(invite_id: int, user_id: int, status: InviteStatus):
+    """
+    Guests may accept or decline an invite only while it is Sent, and leave a diary by declining an invite they
+    accepted. Owners may revoke, i.e. decline, an invite whatever its status, and guests can't undo that.
+
+    :return: UPDATE of the invite returning (user_id, guest_id), matching no row if the user may not change it
+    """
+    guest_from = [InviteStatus.Sent]
+    if status is InviteStatus.Declined:
+        guest_from.append(InviteStatus.Accepted)
+    allowed = and_(
+        sa_diary_invites.c.guest_id == user_id,
+        sa_diary_invites.c.status.in_(guest_from),
+    )
+    if status is InviteStatus.Declined:
+        allowed = or_(allowed, sa_diary_invites.c.user_id == user_id)
+
+    return sa_diary_invites.update().where(and_(
+        sa_diary_invites.c.id == invite_id,
+        allowed,
+    )).values(status=status).returning(sa_diary_invites.c.user_id, sa_diary_invites.c.guest_id)
+
+
+def accepted_guests(owner_id):
+    """ :return: query of the ids of the guests owner_id accepted into their diary """
+    return select([sa_diary_invites.c.guest_id]).where(and_(
+        sa_diary_invites.c.user_id == owner_id,
+        sa_diary_invites.c.status == InviteStatus.Accepted,
+    ))
+
+
+def _upsert_feed(rows):
+    """ Insert (guest_id, created_on, owner_id, highlights) rows selected by rows, replacing highlights of re-saves """
+    feed = insert(sa_family_feed).from_select(
+        [sa_family_feed.c.guest_id, sa_family_feed.c.created_on, sa_family_feed.c.owner_id, sa_family_feed.c.highlights],
+        rows)
+    return feed.on_conflict_do_update(
+        index_elements=[sa_family_feed.c.guest_id, sa_family_feed.c.created_on, sa_family_feed.c.owner_id],
+        set_={'highlights': feed.excluded.highlights},
+    )
+
+
+async def fan_out(conn, owner_id: int, date: datetime.date, highlights: str):
+    """
+    Copy the highlights of a saved diary entry into the family feed of every accepted guest of its owner, in one
+    statement however many guests there are.
+    """
+    guests = accepted_guests(owner_id).alias('guests')
+    await conn.execute(_upsert_feed(select([
+        guests.c.guest_id,
+        literal(date, sa_family_feed.c.created_on.type),
+        literal(owner_id, sa_family_feed.c.owner_id.type),
+        literal(highlights, sa_family_feed.c.highlights.type),
+    ])))
+
+
+async def update_feed(conn, settings, owner_id: int, guest_id: int, status: InviteStatus):
+    """
+    Bring the family feed in line with a changed invite: switch the owner between fan out and pull when the number of
+    accepted guests crosses FAMILY_FEED_FANOUT_LIMIT, and add or remove the owner's recent entries in the guest's feed.
+
+    :param conn: connection within the transaction changing the invite
+    """
+    result = await conn.execute(select([func.count()]).select_from(accepted_guests(owner_id).alias('guests')))
+    pull = await result.scalar() > settings.FAMILY_FEED_FANOUT_LIMIT
+
+    result = await conn.execute(sa_users.update().where(and_(
+        sa_users.c.id == owner_id,
+        sa_users.c.family_feed_pull != pull,
+    )).values(family_feed_pull=pull).returning(sa_users.c.id))
+    switched = await result.scalar() is not None
+
+    if pull:
+        if switched:
+            # every invite, so that this guest's rows go too when it was just declined
+            all_guests = select([sa_diary_invites.c.guest_id]).where(sa_diary_invites.c.user_id == owner_id)
+            await conn.execute(sa_family_feed.delete().where(and_(
+                sa_family_feed.c.guest_id.in_(all_guests),
+                sa_family_feed.c.owner_id == owner_id,
+            )))
+        return
+
+    if status is not InviteStatus.Accepted:
+        await conn.execute(sa_family_feed.delete().where(and_(
+            sa_family_feed.c.guest_id == guest_id,
+            sa_family_feed.c.owner_id == owner_id,
+        )))
+
+    if switched or status is InviteStatus.Accepted:
+        since = datetime.date.today() - datetime.timedelta(days=settings.FAMILY_FEED_BACKFILL_DAYS)
+        guests = accepted_guests(owner_id)
+        if not switched:
+            guests = guests.where(sa_diary_invites.c.guest_id == guest_id)
+        guests = guests.alias('guests')
+
+        await conn.execute(_upsert_feed(select([
+            guests.c.guest_id,
+            sa_diary_entries.c.created_on,
+            sa_diary_entries.c.user_id,
+            sa_diary_entries.c.highlights,
+        ]).where(and_(
+            sa_diary_entries.c.user_id == owner_id,
+            sa_diary_entries.c.created_on >= since,
+        ))))
@@ -0,0 +1,79 @@
+"""
+Summarizes diary moments into highlights.
+
+Moments are separated by blank lines. Each one is cut at its first sentence ending ("!" or "."), or before its first
+":" or "-" when that comes earlier, and is otherwise shortened to HIGHLIGHT_LENGTH characters.
+"""
+import re
+
+HIGHLIGHT_LENGTH = 100
+
+SEPARATOR_RE = re.compile('(?:\r?\n){2}')
+# sentence endings and trail characters are found with a single scan of each moment
+CUT_RE = re.compile('[!.:-]')
+ENDING_RE = re.compile('[!.]')
+
+
+def highlight(moments: str) -> str:
+    """
+    :param moments: moments text as written in the diary
+    :return: highlights of all moments, joined by spaces
+    """
+    return ' '.join(_highlights(moments))
+
+
+def highlight_many(entries) -> list:
+    """
+    Batch version of highlight, e.g. to recompute highlights for many diary entries at once.
+
+    :param entries: iterable of moments texts
+    :return: list of highlights in the same order
+    """
+    # every moment costs one search either way, joining the entries to scan them in one pass only adds the
+    # copy and the bookkeeping to split the moments back up, which measured slower
+    return [' '.join(_highlights(moments)) for moments in entries]
+
+
+def _moments(text):
+    """
+    Yields (start, end) offsets of every moment in text, so that moments don't need to be copied out of it.
+    """
+    start = 0
+    if '\r' in text:
+        for separator in SEPARATOR_RE.finditer(text):
+            yield start, separator.start()
+            start = separator.end()
+
+    else:
+        # the common case, str.find is a lot faster than scanning with SEPARATOR_RE
+        end = text.find('\n\n')
+        while end >= 0:
+            yield start, end
+            start = end + 2
+            end = text.find('\n\n', start)
+
+    yield start, len(text)
+
+
+def _highlights(text, cut_search=CUT_RE.search, ending_search=ENDING_RE.search):
+    highlights = []
+    for start, end in _moments(text):
+        cut = cut_search(text, start, end)
+
+        if cut is not None and text[cut.start()] in ':-':
+            index = cut.start()
+            if index > start:
+                highlights.append(text[start:index].strip() + '...')
+                continue
+
+            # a moment starting with ":" or "-" is only cut at a sentence ending
+            cut = ending_search(text, index + 1, end)
+
+        if cut is not None and cut.start() - start < HIGHLIGHT_LENGTH:
+            highlights.append(text[start:cut.start() + 1].strip())
+        elif end - start > HIGHLIGHT_LENGTH:
+            highlights.append(text[start:start + HIGHLIGHT_LENGTH].strip() + '...')
+        else:
+            highlights.append(text[start:end].strip())
+
+    return highlights
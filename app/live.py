@@ -0,0 +1,223 @@
+"""
+Live family updates: highlights saved by Day.post are pushed over WebSockets to the guests of their owner.
+
+Day.post sends a NOTIFY with the highlights inside its transaction, so it is delivered once the entry is committed,
+and to every worker. Each worker LISTENs on a single connection of its pool and hands every notification to the
+sockets of the owner's guests connected to it. Every socket has a bounded send queue, a guest whose queue is full,
+e.g. a phone on a stalled connection, is disconnected rather than buffered for, clients reconnect and catch up from
+the family feed.
+"""
+import asyncio
+from collections import defaultdict
+import json
+import logging
+
+from aiohttp import WSCloseCode
+from sqlalchemy import func, select
+
+log = logging.getLogger(__name__)
+
+CHANNEL = 'family_live'
+# NOTIFY payloads must be shorter than 8000 bytes
+MAX_PAYLOAD_BYTES = 7999
+
+
+def entry_message(owner_id: int, date, highlights: str) -> str:
+    """
+    :return: notification payload of a saved diary entry. Highlights that don't fit into a notification are left
+             out, clients then have to read them from the feed.
+    """
+    payload = {'type': 'entry', 'owner_id': owner_id, 'date': date.isoformat(), 'highlights': highlights}
+    message = json.dumps(payload)
+    if len(message.encode()) > MAX_PAYLOAD_BYTES:
+        del payload['highlights']
+        message = json.dumps(payload)
+    return message
+
+
+async def notify_entry(conn, owner_id: int, date, highlights: str):
+    """ Tell every worker about a saved diary entry, sent when the transaction of conn commits """
+    await conn.execute(select([func.pg_notify(CHANNEL, entry_message(owner_id, date, highlights))]))
+
+
+async def notify_invite(conn, owner_id: int, guest_id: int, accepted: bool):
+    """ Tell every worker to start or stop sending the owner's entries to the guest's sockets """
+    message = json.dumps({'type': 'invite', 'owner_id': owner_id, 'guest_id': guest_id, 'accepted': accepted})
+    await conn.execute(select([func.pg_notify(CHANNEL, message)]))
+
+
+class Subscriber:
+    """
+    A guest's WebSocket, with a queue of the messages waiting to be sent to it.
+    """
+    def __init__(self, ws, guest_id: int, owner_ids, queue_size: int, loop):
+        """
+        :param ws: prepared aiohttp WebSocketResponse
+        :param guest_id: user the socket belongs to
+        :param owner_ids: owners whose entries the guest may read
+        :param queue_size: number of messages that may wait to be sent before the guest is dropped
+        """
+        self.ws = ws
+        self.guest_id = guest_id
+        self.owner_ids = set(owner_ids)
+        self.queue = asyncio.Queue(queue_size)
+        self.loop = loop
+        self.sender = loop.create_task(self._send())
+        self.dropped = False
+
+    def offer(self, message: str) -> bool:
+        """ :return: whether the message was queued, False when the guest can't keep up """
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _send(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                self.ws.send_str(message)
+                await self.ws.drain()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # the socket closed under us, its handler unsubscribes it
+            log.debug('live update not sent to %d: %s', self.guest_id, e)
+
+    def drop(self):
+        self.dropped = True
+        self.sender.cancel()
+        self.loop.create_task(self.ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=b'too slow'))
+
+    def close(self):
+        self.sender.cancel()
+
+
+class LiveHub:
+    """
+    The sockets of guests connected to this worker, indexed by the owners whose entries they receive.
+
+    Notifications are parsed and encoded once, whatever the number of guests they go to.
+    """
+    def __init__(self, queue_size: int, ping_interval: int, retry_interval: int, family_index=None):
+        """
+        :param queue_size: messages queued per socket before the guest is dropped
+        :param ping_interval: seconds without notifications after which the LISTEN connection is checked
+        :param retry_interval: seconds to wait before listening again when the connection failed
+        :param family_index: FamilyIndex of this worker, invite notifications from other workers invalidate it
+        """
+        self.family_index = family_index
+        self.queue_size = queue_size
+        self.ping_interval = ping_interval
+        self.retry_interval = retry_interval
+        self.by_owner = defaultdict(set)
+        self.by_guest = defaultdict(set)
+        self.notifications = 0
+        self.sent = 0
+        self.dropped = 0
+
+    def subscribe(self, ws, guest_id: int, owner_ids, loop) -> Subscriber:
+        subscriber = Subscriber(ws, guest_id, owner_ids, self.queue_size, loop)
+        self.by_guest[guest_id].add(subscriber)
+        for owner_id in subscriber.owner_ids:
+            self.by_owner[owner_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscriber.close()
+        _discard(self.by_guest, subscriber.guest_id, subscriber)
+        for owner_id in subscriber.owner_ids:
+            _discard(self.by_owner, owner_id, subscriber)
+
+    def dispatch(self, message: str):
+        """ Hand a notification payload to the subscribers it concerns """
+        self.notifications += 1
+        payload = json.loads(message)
+
+        if payload['type'] == 'entry':
+            subscribers = self.by_owner.get(payload['owner_id'])
+            if not subscribers:
+                return
+            del payload['type']
+            message = json.dumps(payload)
+            for subscriber in list(subscribers):
+                if subscriber.offer(message):
+                    self.sent += 1
+                else:
+                    self.dropped += 1
+                    subscriber.drop()
+                    self.unsubscribe(subscriber)
+
+        elif payload['type'] == 'invite':
+            owner_id = payload['owner_id']
+            if self.family_index is not None:
+                self.family_index.invalidate(payload['guest_id'])
+            for subscriber in self.by_guest.get(payload['guest_id'], ()):
+                if payload['accepted']:
+                    subscriber.owner_ids.add(owner_id)
+                    self.by_owner[owner_id].add(subscriber)
+                else:
+                    subscriber.owner_ids.discard(owner_id)
+                    _discard(self.by_owner, owner_id, subscriber)
+
+    async def listen(self, engine):
+        """
+        LISTEN for notifications on one connection of the engine and dispatch them until cancelled, reconnecting
+        when the connection fails.
+        """
+        while True:
+            try:
+                async with engine.acquire() as conn:
+                    try:
+                        await conn.execute('LISTEN {}'.format(CHANNEL))
+                        notifies = conn.connection.notifies
+                        while True:
+                            try:
+                                notification = await asyncio.wait_for(notifies.get(), self.ping_interval)
+                            except asyncio.TimeoutError:
+                                # a dead connection gets no notifications either, make sure it is alive
+                                await conn.execute('SELECT 1')
+                                continue
+
+                            try:
+                                self.dispatch(notification.payload)
+                            except Exception as e:
+                                log.error('bad live update %r: %s', notification.payload, e)
+                    finally:
+                        # never hand a listening connection back to the pool. Closing it instead would leave the
+                        # pool's wait_closed waiting for it on shutdown
+                        try:
+                            await conn.execute('UNLISTEN {}'.format(CHANNEL))
+                        except Exception:
+                            conn.connection.close()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(e, exc_info=1)
+
+            await asyncio.sleep(self.retry_interval)
+
+    async def close(self):
+        """ Close every socket, e.g. on shutdown """
+        subscribers = [subscriber for guest in self.by_guest.values() for subscriber in guest]
+        for subscriber in subscribers:
+            self.unsubscribe(subscriber)
+            await subscriber.ws.close(code=WSCloseCode.GOING_AWAY, message=b'server shutdown')
+
+    def stats(self) -> dict:
+        return {
+            'subscribers': sum(len(guest) for guest in self.by_guest.values()),
+            'notifications': self.notifications,
+            'sent': self.sent,
+            'dropped': self.dropped,
+        }
+
+
+def _discard(index: dict, key: int, subscriber: Subscriber):
+    subscribers = index.get(key)
+    if subscribers is not None:
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del index[key]
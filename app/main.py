@@ -1,20 +1,29 @@
-import base64
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import aiohttp_jinja2
-import aiohttp_session
 import jinja2
 from aiohttp import web
 from aiohttp_jinja2 import APP_KEY as JINJA2_APP_KEY
-from aiohttp_session.cookie_storage import EncryptedCookieStorage
 
 from aiopg.sa import create_engine
 from sqlalchemy.engine.url import URL
 
+from .db import MonitoredEngine, pool_timeout_middleware, report_pool_stats, request_connection_middleware
+from .family import FamilyIndex
+from .live import LiveHub
+from .metrics import Metrics, metrics_middleware, timed_template_class
+from .page_cache import create_page_cache
+from .passwords import PasswordHasher
 from .settings import Settings
+from .statements import compile_statements
+from .throttle import LoginThrottle
+from .user import create_session_store, reap_sessions, set_session_cookie, sweep_sessions
 from .views import index
+from .views.metrics import metrics
 from .views.user import Login, Join, Logout
-from .views.diary import Day, Month, Year, MyDiary
+from .views.diary import Day, Export, Import, Month, Search, Timeline, Year, MyDiary, add_version_headers
+from .views.family import Feed, Invite, live
 
 
 THIS_DIR = Path(__file__).parent
@@ -52,6 +61,22 @@ def reverse_url(context, name, **parts):
     return app.router[name].url(**kwargs)
 
 
+@jinja2.contextfilter
+def diary_url(context, name, **parts):
+    """
+    jinja2 filter for links between diary pages, like url but pointing to the family urls, e.g. "family-diary-month"
+    for "diary-month", when the page shows the diary of the owner_id in the context.
+
+    Usage:
+
+      {{ 'diary-month'|diary_url(year=2017, month=1) }} might become "/diary/2017/1" or "/family/3/diary/2017/1"
+    """
+    if context.get('owner_id'):
+        name = 'family-' + name
+        parts['owner_id'] = context['owner_id']
+    return reverse_url(context, name, **parts)
+
+
 @jinja2.contextfilter
 def static_url(context, static_file_path):
     """
@@ -91,16 +116,55 @@ def pg_dsn(settings: Settings) -> str:
 
 
 async def startup(app: web.Application):
-    app['pg_engine'] = await create_engine(pg_dsn(app['settings']), loop=app.loop)
+    settings = app['settings']
+    engine = await create_engine(
+        pg_dsn(settings),
+        minsize=settings.DB_POOL_MINSIZE,
+        maxsize=settings.DB_POOL_MAXSIZE,
+        options='-c statement_timeout={}'.format(settings.DB_STATEMENT_TIMEOUT),
+        loop=app.loop,
+    )
+    app['pg_engine'] = MonitoredEngine(engine, acquire_timeout=settings.DB_ACQUIRE_TIMEOUT)
+    compile_statements(engine.dialect)
+    if settings.DB_POOL_STATS_INTERVAL:
+        app['pg_stats_reporter'] = app.loop.create_task(
+            report_pool_stats(app['pg_engine'], settings.DB_POOL_STATS_INTERVAL))
+    app['password_hasher'] = PasswordHasher(
+        app.loop,
+        workers=settings.PASSWORD_HASH_WORKERS,
+        max_pending=settings.PASSWORD_HASH_MAX_PENDING,
+        use_processes=settings.PASSWORD_HASH_PROCESSES,
+    )
+    app['import_executor'] = ThreadPoolExecutor(max_workers=settings.IMPORT_WORKERS)
+    if settings.SESSION_SWEEP_INTERVAL:
+        app['session_sweeper'] = app.loop.create_task(
+            sweep_sessions(app['session_store'], settings.SESSION_SWEEP_INTERVAL))
+    if settings.SESSION_REAP_INTERVAL:
+        app['session_reaper'] = app.loop.create_task(reap_sessions(
+            app['pg_engine'], settings.SESSION_TTL, settings.SESSION_REAP_INTERVAL, settings.SESSION_REAP_BATCH_SIZE))
+    if settings.LIVE_UPDATES:
+        app['live_listener'] = app.loop.create_task(app['live_hub'].listen(app['pg_engine']))
+
+
+async def shutdown(app: web.Application):
+    await app['live_hub'].close()
 
 
 async def cleanup(app: web.Application):
+    if 'pg_stats_reporter' in app:
+        app['pg_stats_reporter'].cancel()
+    for task in ('session_sweeper', 'session_reaper', 'live_listener'):
+        if task in app:
+            app[task].cancel()
+    app['password_hasher'].close()
+    app['import_executor'].shutdown(wait=False)
     app['pg_engine'].close()
     await app['pg_engine'].wait_closed()
 
 
 def setup_routes(app):
     app.router.add_get('/', index, name='index')
+    app.router.add_get('/metrics', metrics, name='metrics')
 
     # User
     app.router.add_route('*', '/login', Login, name='login')
@@ -109,32 +173,56 @@ def setup_routes(app):
 
     # Diary
     app.router.add_route('*', '/diary/new', Day, name='diary-new')
+    app.router.add_route('*', '/diary/export', Export, name='diary-export')
+    app.router.add_route('*', '/diary/import', Import, name='diary-upload')
+    app.router.add_route('*', '/diary/search', Search, name='diary-search')
+    app.router.add_route('*', '/diary/timeline', Timeline, name='diary-timeline')
     app.router.add_route('*', '/diary/{year}/{month}/{day}', Day, name='diary-day')
     app.router.add_route('*', '/diary/{year}/{month}', Month, name='diary-month')
     app.router.add_route('*', '/diary/{year}', Year, name='diary-year')
     app.router.add_route('*', '/diary', MyDiary, name='diary')
 
+    # Family
+    app.router.add_route('*', r'/family/invites/{invite_id:\d+}', Invite, name='family-invite')
+    app.router.add_get('/family/feed', Feed, name='family-feed')
+    app.router.add_get('/family/live', live, name='family-live')
+    app.router.add_get(r'/family/{owner_id:\d+}/diary/{year}/{month}/{day}', Day, name='family-diary-day')
+    app.router.add_get(r'/family/{owner_id:\d+}/diary/{year}/{month}', Month, name='family-diary-month')
+    app.router.add_get(r'/family/{owner_id:\d+}/diary/{year}', Year, name='family-diary-year')
+    app.router.add_get(r'/family/{owner_id:\d+}/diary', MyDiary, name='family-diary')
+
 
 def create_app(loop):
-    app = web.Application()
+    app = web.Application(middlewares=[metrics_middleware, pool_timeout_middleware, request_connection_middleware])
     settings = Settings()
+    family_index = FamilyIndex(settings.FAMILY_CACHE_SIZE, settings.FAMILY_CACHE_TTL)
     app.update(
         name='part-of-family',
-        settings=settings
+        settings=settings,
+        metrics=Metrics(),
+        session_store=create_session_store(settings),
+        family_index=family_index,
+        live_hub=LiveHub(settings.LIVE_QUEUE_SIZE, settings.LIVE_PING_INTERVAL, settings.LIVE_RETRY_INTERVAL,
+                         family_index),
+        page_cache=create_page_cache(settings),
+        login_throttle=LoginThrottle(settings.LOGIN_IP_RATE, settings.LOGIN_IP_BURST,
+                                     settings.LOGIN_EMAIL_RATE, settings.LOGIN_EMAIL_BURST),
     )
 
     jinja2_loader = jinja2.FileSystemLoader(str(THIS_DIR / 'templates'))
     aiohttp_jinja2.setup(app, loader=jinja2_loader, app_key=JINJA2_APP_KEY, autoescape=True)
     app[JINJA2_APP_KEY].filters.update(
         url=reverse_url,
+        diary_url=diary_url,
         static=static_url,
     )
+    app[JINJA2_APP_KEY].template_class = timed_template_class(app['metrics'])
 
     app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
     app.on_cleanup.append(cleanup)
-
-    secret_key = base64.urlsafe_b64decode(settings.COOKIE_SECRET)
-    aiohttp_session.setup(app, EncryptedCookieStorage(secret_key))
+    app.on_response_prepare.append(add_version_headers)
+    app.on_response_prepare.append(set_session_cookie)
 
     setup_routes(app)
     return app
@@ -1,8 +1,17 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import datetime
+import json
+import os
+import time
+
 import psycopg2
-from sqlalchemy import create_engine
+from psycopg2.extras import execute_values
+from sqlalchemy import create_engine, extract, func, select
 
+from .db import blocking_connection
+from .highlights import highlight_many
 from .main import pg_dsn
-from .models import Base
+from .models import Base, sa_diary_entries, sa_diary_rollups
 from .settings import Settings
 
 
@@ -46,3 +55,149 @@ def prepare_database(delete_existing: bool) -> bool:
     Base.metadata.create_all(engine)
     engine.dispose()
     return True
+
+
+def rebuild_diary_rollups(user_id: int = None) -> int:
+    """
+    Recount the per month diary rollups from diary entries, e.g. after entries were changed outside of the app.
+
+    :param user_id: only rebuild rollups for this user, otherwise for everyone
+    :return: number of rollup rows written
+    """
+    settings = Settings()
+    year = extract('year', sa_diary_entries.c.created_on)
+    month = extract('month', sa_diary_entries.c.created_on)
+    counts = select([sa_diary_entries.c.user_id, year, month, func.count()]).group_by(
+        sa_diary_entries.c.user_id, year, month)
+    stale_rollups = sa_diary_rollups.delete()
+
+    if user_id is not None:
+        counts = counts.where(sa_diary_entries.c.user_id == user_id)
+        stale_rollups = stale_rollups.where(sa_diary_rollups.c.user_id == user_id)
+
+    engine = create_engine(pg_dsn(settings))
+    with engine.begin() as conn:
+        conn.execute(stale_rollups)
+        result = conn.execute(sa_diary_rollups.insert().from_select(
+            ['user_id', 'year', 'month', 'entries'], counts))
+        rows = result.rowcount
+    engine.dispose()
+
+    print('rebuilt {} diary rollup(s)'.format(rows))
+    return rows
+
+
+def rehighlight(workers: int, batch_size: int, chunks: int, checkpoint: str, restart: bool = False) -> int:
+    """
+    Recompute highlights of all diary entries, e.g. after the highlight rules changed.
+
+    Entries are split into user_id ranges that are processed by a pool of processes. Finished ranges are recorded in
+    the checkpoint file, so an interrupted run picks up where it left off unless restart is given.
+
+    :param workers: number of processes
+    :param batch_size: number of entries fetched, highlighted and updated at a time
+    :param chunks: number of user_id ranges to split the work into
+    :param checkpoint: path of the checkpoint file
+    :param restart: ignore an existing checkpoint file
+    :return: number of entries whose highlights changed
+    """
+    if os.path.exists(checkpoint) and not restart:
+        with open(checkpoint) as f:
+            state = json.load(f)
+        print('resuming from {}, {} of {} ranges already done'.format(checkpoint, len(state['done']), len(state['ranges'])))
+
+    else:
+        conn = blocking_connection(Settings())
+        cur = conn.cursor()
+        cur.execute('SELECT min(user_id), max(user_id) FROM diary_entries')
+        low, high = cur.fetchone()
+        conn.close()
+        if low is None:
+            print('no diary entries to rehighlight')
+            return 0
+
+        step = max(1, (high - low + chunks) // chunks)
+        state = {
+            'ranges': [[start, min(start + step, high + 1)] for start in range(low, high + 1, step)],
+            'done': [],
+        }
+
+    pending = [r for r in state['ranges'] if r not in state['done']]
+    seen = updated = 0
+    start_time = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(rehighlight_range, low, high, batch_size): [low, high] for low, high in pending}
+        for future in as_completed(futures):
+            range_seen, range_updated = future.result()
+            seen += range_seen
+            updated += range_updated
+
+            state['done'].append(futures[future])
+            with open(checkpoint, 'w') as f:
+                json.dump(state, f)
+
+            elapsed = time.perf_counter() - start_time
+            print('{}/{} ranges, {} entries checked, {} updated, {:.0f} entries/s'.format(
+                len(state['done']), len(state['ranges']), seen, updated, seen / elapsed if elapsed else 0))
+
+    os.remove(checkpoint)
+    return updated
+
+
+def rehighlight_range(low: int, high: int, batch_size: int) -> tuple:
+    """
+    Recompute highlights of diary entries with low <= user_id < high, runs in a worker process.
+
+    Entries are streamed through a server side cursor, only those whose highlights changed are written back with a
+    multi-row UPDATE per batch, unless their moments changed since they were read. Copies of their highlights in
+    family feeds are updated along with them, and the diary version and modification time of their owners are bumped
+    so that cached and conditional pages refresh.
+
+    :return: number of entries checked and number of entries updated
+    """
+    settings = Settings()
+    reader = blocking_connection(settings)
+    writer = blocking_connection(settings)
+    seen = updated = 0
+
+    try:
+        cur = reader.cursor(name='rehighlight_{}_{}'.format(low, high))
+        cur.itersize = batch_size
+        cur.execute('SELECT id, user_id, highlights, moments FROM diary_entries '
+                    'WHERE user_id >= %s AND user_id < %s', (low, high))
+
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+
+            seen += len(rows)
+            highlights = highlight_many(row[3] for row in rows)
+            changed = [(row[0], new, row[3]) for row, new in zip(rows, highlights) if row[2] != new]
+            if not changed:
+                continue
+
+            with writer, writer.cursor() as write_cur:
+                # entries saved since they were read keep the highlights Day.post gave them
+                execute_values(write_cur, 'UPDATE diary_entries AS d SET highlights = v.highlights '
+                                          'FROM (VALUES %s) AS v (id, highlights, moments) '
+                                          'WHERE d.id = v.id AND d.moments = v.moments RETURNING d.id, d.user_id',
+                               changed, page_size=len(changed))
+                written = write_cur.fetchall()
+                if not written:
+                    continue
+
+                write_cur.execute('UPDATE family_feed AS f SET highlights = d.highlights FROM diary_entries AS d '
+                                  'WHERE d.id = ANY(%s) AND f.owner_id = d.user_id AND f.created_on = d.created_on',
+                                  ([entry_id for entry_id, _ in written],))
+                write_cur.execute('UPDATE users SET diary_version = diary_version + 1, diary_modified_on = %s '
+                                  'WHERE id = ANY(%s)',
+                                  (datetime.datetime.utcnow(), list({user_id for _, user_id in written})))
+            updated += len(written)
+
+    finally:
+        reader.close()
+        writer.close()
+
+    return seen, updated
@@ -0,0 +1,217 @@
+from bisect import bisect_left
+from collections import defaultdict
+import logging
+import time
+
+from aiohttp import web
+import jinja2
+
+log = logging.getLogger(__name__)
+
+# upper bounds in seconds, suitable for anything from a pool checkout to a full request
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# WebSocket sessions last from seconds to hours
+SESSION_BUCKETS = (1, 10, 60, 300, 900, 3600, 4 * 3600, 12 * 3600)
+
+
+class Histogram:
+    """
+    Fixed bucket histogram of observed durations, in the cumulative form Prometheus expects.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        :param buckets: sorted upper bounds of the buckets, an implicit +Inf bucket is added
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> list:
+        """ :return: list of (upper bound, number of observations less than or equal to it) """
+        total = 0
+        cumulative = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+    def stats(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': self.cumulative_counts(),
+        }
+
+
+class Metrics:
+    """
+    Per worker request, database and template timings, see metrics_middleware and TimedTemplate.
+    """
+    def __init__(self):
+        self.requests = defaultdict(int)
+        self.request_time = defaultdict(Histogram)
+        self.request_db_time = defaultdict(Histogram)
+        self.request_queries = defaultdict(int)
+        self.render_time = defaultdict(Histogram)
+        self.websocket_time = defaultdict(lambda: Histogram(SESSION_BUCKETS))
+
+    def observe_request(self, route: str, status: int, elapsed: float, db_time: float, queries: int):
+        self.requests[(route, status)] += 1
+        self.request_time[route].observe(elapsed)
+        self.request_db_time[route].observe(db_time)
+        self.request_queries[route] += queries
+
+    def observe_websocket(self, route: str, status: int, elapsed: float):
+        self.requests[(route, status)] += 1
+        self.websocket_time[route].observe(elapsed)
+
+
+def timed_template_class(metrics: Metrics):
+    """ :return: jinja2 template class that records render times in metrics, for Environment.template_class """
+    class TimedTemplate(jinja2.Template):
+        def render(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return super().render(*args, **kwargs)
+            finally:
+                metrics.render_time[self.name].observe(time.perf_counter() - start)
+
+    return TimedTemplate
+
+
+def route_name(request) -> str:
+    """ :return: name given to the matched route in setup_routes """
+    route = getattr(request.match_info, 'route', None)
+    return getattr(route, 'name', None) or 'unnamed'
+
+
+async def metrics_middleware(app, handler):
+    """
+    Records latency, database time and statement count per route, and logs requests slower than
+    SLOW_REQUEST_THRESHOLD milliseconds. WebSocket sessions are timed on their own, they would swamp the latencies.
+    """
+    metrics = app['metrics']
+    slow_threshold = app['settings'].SLOW_REQUEST_THRESHOLD / 1000
+
+    async def middleware(request):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+
+        except web.HTTPException as e:
+            status = e.status
+            raise
+
+        finally:
+            elapsed = time.perf_counter() - start
+            route = route_name(request)
+            if request.headers.get('Upgrade', '').lower() == 'websocket':
+                metrics.observe_websocket(route, status, elapsed)
+            else:
+                pg_conn = request.get('pg_conn')
+                db_time = pg_conn.db_time if pg_conn else 0
+                queries = pg_conn.queries if pg_conn else 0
+                metrics.observe_request(route, status, elapsed, db_time, queries)
+
+                if slow_threshold and elapsed >= slow_threshold:
+                    log.warning('Slow request %s %s (%s): %.1fms, %d queries taking %.1fms', request.method,
+                                request.path, route, elapsed * 1000, queries, db_time * 1000)
+    return middleware
+
+
+def _labels(**labels) -> str:
+    return '{' + ','.join('{}="{}"'.format(name, value) for name, value in sorted(labels.items())) + '}'
+
+
+def _histogram_lines(name: str, histogram: Histogram, **labels) -> list:
+    lines = []
+    for bound, count in histogram.cumulative_counts():
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        lines.append('{}_bucket{} {}'.format(name, _labels(le=le, **labels), count))
+    lines.append('{}_sum{} {}'.format(name, _labels(**labels), histogram.sum))
+    lines.append('{}_count{} {}'.format(name, _labels(**labels), histogram.count))
+    return lines
+
+
+def prometheus_text(app) -> str:
+    """ :return: metrics of this worker in the Prometheus text exposition format """
+    metrics = app['metrics']
+    lines = ['# TYPE pof_requests_total counter']
+    for (route, status), count in sorted(metrics.requests.items()):
+        lines.append('pof_requests_total{} {}'.format(_labels(route=route, status=status), count))
+
+    lines.append('# TYPE pof_request_seconds histogram')
+    for route, histogram in sorted(metrics.request_time.items()):
+        lines.extend(_histogram_lines('pof_request_seconds', histogram, route=route))
+
+    lines.append('# TYPE pof_request_db_seconds histogram')
+    for route, histogram in sorted(metrics.request_db_time.items()):
+        lines.extend(_histogram_lines('pof_request_db_seconds', histogram, route=route))
+
+    lines.append('# TYPE pof_request_queries_total counter')
+    for route, count in sorted(metrics.request_queries.items()):
+        lines.append('pof_request_queries_total{} {}'.format(_labels(route=route), count))
+
+    lines.append('# TYPE pof_template_render_seconds histogram')
+    for template, histogram in sorted(metrics.render_time.items()):
+        lines.extend(_histogram_lines('pof_template_render_seconds', histogram, template=template))
+
+    lines.append('# TYPE pof_websocket_session_seconds histogram')
+    for route, histogram in sorted(metrics.websocket_time.items()):
+        lines.extend(_histogram_lines('pof_websocket_session_seconds', histogram, route=route))
+
+    if 'pg_engine' in app:
+        pool = app['pg_engine'].stats()
+        lines.append('# TYPE pof_db_pool_connections gauge')
+        for state in ('in_use', 'free'):
+            lines.append('pof_db_pool_connections{} {}'.format(_labels(state=state), pool[state]))
+        lines.append('# TYPE pof_db_pool_waiters gauge')
+        lines.append('pof_db_pool_waiters {}'.format(pool['waiters']))
+        lines.append('# TYPE pof_db_pool_timeouts_total counter')
+        lines.append('pof_db_pool_timeouts_total {}'.format(pool['timeouts']))
+        lines.append('# TYPE pof_db_pool_acquire_seconds histogram')
+        lines.extend(_histogram_lines('pof_db_pool_acquire_seconds', app['pg_engine'].acquire_wait))
+
+    if hasattr(app['session_store'], 'stats'):
+        session_store = app['session_store'].stats()
+        lines.append('# TYPE pof_session_cache_lookups_total counter')
+        for result in ('hits', 'misses'):
+            lines.append('pof_session_cache_lookups_total{} {}'.format(_labels(result=result), session_store[result]))
+
+    family_index = app['family_index'].stats()
+    lines.append('# TYPE pof_family_index_lookups_total counter')
+    for result in ('hits', 'misses'):
+        lines.append('pof_family_index_lookups_total{} {}'.format(_labels(result=result), family_index[result]))
+
+    live_hub = app['live_hub'].stats()
+    lines.append('# TYPE pof_live_subscribers gauge')
+    lines.append('pof_live_subscribers {}'.format(live_hub['subscribers']))
+    lines.append('# TYPE pof_live_notifications_total counter')
+    lines.append('pof_live_notifications_total {}'.format(live_hub['notifications']))
+    lines.append('# TYPE pof_live_messages_total counter')
+    for result in ('sent', 'dropped'):
+        lines.append('pof_live_messages_total{} {}'.format(_labels(result=result), live_hub[result]))
+
+    if hasattr(app['page_cache'], 'stats'):
+        page_cache = app['page_cache'].stats()
+        lines.append('# TYPE pof_page_cache_lookups_total counter')
+        for result in ('hits', 'misses'):
+            lines.append('pof_page_cache_lookups_total{} {}'.format(_labels(result=result), page_cache[result]))
+        lines.append('# TYPE pof_page_cache_bytes gauge')
+        lines.append('pof_page_cache_bytes {}'.format(page_cache['bytes']))
+
+    lines.append('# TYPE pof_login_attempts_total counter')
+    for key, stats in sorted(app['login_throttle'].stats().items()):
+        for result in ('allowed', 'rejected'):
+            lines.append('pof_login_attempts_total{} {}'.format(_labels(key=key, result=result), stats[result]))
+
+    return '\n'.join(lines) + '\n'
@@ -1,6 +1,8 @@
 import enum
 
-from sqlalchemy import Column, DateTime, Date, Integer, Sequence, String, Text, func, Enum
+from sqlalchemy import (DDL, Boolean, Column, DateTime, Date, Integer, Sequence, String, Text, event, false, func,
+                        literal_column, Enum, UniqueConstraint)
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -18,6 +20,12 @@ class User(Base):
     birth_year = Column(Integer)
     death_year = Column(Integer)
     created_on = Column(DateTime(), server_default=func.now(), nullable=False)
+    # bumped by every diary save, used to answer conditional requests for diary pages
+    diary_version = Column(Integer, server_default='0', nullable=False)
+    diary_modified_on = Column(DateTime())
+    # set for owners with more accepted guests than FAMILY_FEED_FANOUT_LIMIT, whose entries guests pull into the
+    # family feed instead of Day.post writing them into family_feed for each guest
+    family_feed_pull = Column(Boolean, server_default=false(), nullable=False)
 
 
 class UserSession(Base):
@@ -27,19 +35,34 @@ class UserSession(Base):
     client_ip = Column(String(32), nullable=False)
     client_agent = Column(String(256))
     user_id = Column(Integer, nullable=False)
-    created_on = Column(DateTime(), server_default=func.now(), nullable=False)
+    # indexed for the reaper deleting expired sessions
+    created_on = Column(DateTime(), server_default=func.now(), index=True, nullable=False)
 
 
 class DiaryEntry(Base):
     __tablename__ = 'diary_entries'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'created_on', name='uq_diary_entries_user_id_created_on'),
+    )
 
     id = Column(Integer, Sequence('diary_entry_id_seq'), primary_key=True, nullable=False)
-    user_id = Column(Integer, index=True, nullable=False)
-    created_on = Column(Date(), index=True, nullable=False)
+    # the unique constraint doubles as the (user_id, created_on) index every diary query filters on
+    user_id = Column(Integer, nullable=False)
+    created_on = Column(Date(), nullable=False)
     highlights = Column(Text, nullable=False)
     moments = Column(Text, nullable=False)
 
 
+class DiaryRollup(Base):
+    """ Number of diary entries per user and month, maintained by Day.post """
+    __tablename__ = 'diary_rollups'
+
+    user_id = Column(Integer, primary_key=True, nullable=False)
+    year = Column(Integer, primary_key=True, nullable=False)
+    month = Column(Integer, primary_key=True, nullable=False)
+    entries = Column(Integer, nullable=False, default=0)
+
+
 class InviteStatus(enum.Enum):
     Sent = 1
     Accepted = 2
@@ -65,7 +88,36 @@ class DiaryInvite(Base):
     status = Column(Enum(InviteStatus), nullable=False)
 
 
+class FamilyFeedItem(Base):
+    """
+    Highlights of a diary entry, copied for each guest of its owner so that the family feed is read from one index.
+    The primary key doubles as that index, feeds are read newest day first.
+    """
+    __tablename__ = 'family_feed'
+
+    guest_id = Column(Integer, primary_key=True, nullable=False)
+    created_on = Column(Date(), primary_key=True, nullable=False)
+    owner_id = Column(Integer, primary_key=True, nullable=False)
+    highlights = Column(Text, nullable=False)
+
+
 sa_users = User.__table__
 sa_user_sessions = UserSession.__table__
 sa_diary_entries = DiaryEntry.__table__
+sa_diary_rollups = DiaryRollup.__table__
 sa_diary_invites = DiaryInvite.__table__
+sa_family_feed = FamilyFeedItem.__table__
+
+# text search configuration of the diary search, changing it needs a migration regenerating moments_tsv
+SEARCH_CONFIG = 'english'
+
+# moments_tsv is generated by Postgres and deliberately not a column of DiaryEntry, so that it is never selected or
+# written along with entries. The (user_id, moments_tsv) GIN index needs btree_gin for the integer column.
+diary_moments_tsv = literal_column('diary_entries.moments_tsv', type_=TSVECTOR)
+
+event.listen(sa_diary_entries, 'after_create', DDL(
+    "ALTER TABLE diary_entries ADD COLUMN moments_tsv tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('{config}', moments)) STORED; "
+    "CREATE EXTENSION IF NOT EXISTS btree_gin; "
+    "CREATE INDEX ix_diary_entries_search ON diary_entries USING gin (user_id, moments_tsv)".format(config=SEARCH_CONFIG)
+))
@@ -0,0 +1,103 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import time
+
+
+class PageCache(ABC):
+    """
+    Interface for caches of rendered diary pages.
+
+    Methods are coroutines so that a backend shared by all gunicorn workers, e.g. on memcached or redis, can be
+    plugged in through the PAGE_CACHE_BACKEND setting without touching the views.
+    """
+    @abstractmethod
+    async def get(self, key: tuple):
+        """ :return: cached page body as bytes, or None """
+
+    @abstractmethod
+    async def set(self, key: tuple, body: bytes):
+        """ Cache a rendered page, backends may drop it e.g. when it is too large """
+
+
+class LocalPageCache(PageCache):
+    """
+    Page cache held in the memory of a single worker, evicting least recently used pages beyond max_bytes.
+
+    Pages are keyed by diary version, so a save in any worker makes the pages cached before it unreachable. Those
+    are evicted as least recently used, or once they expire after ttl seconds.
+    """
+    def __init__(self, max_bytes: int, ttl: int, timer=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.timer = timer
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+
+    async def get(self, key):
+        try:
+            expires_on, body = self._pages[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        if expires_on <= self.timer():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._pages.move_to_end(key)
+        self.hits += 1
+        return body
+
+    async def set(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+
+        self._remove(key)
+        self._pages[key] = (self.timer() + self.ttl, body)
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self._pages.popitem(last=False)
+            self.size -= len(evicted)
+
+    def _remove(self, key):
+        entry = self._pages.pop(key, None)
+        if entry:
+            self.size -= len(entry[1])
+
+    def stats(self) -> dict:
+        return {
+            'pages': len(self._pages),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+PAGE_CACHE_BACKENDS = {
+    'local': lambda settings: LocalPageCache(settings.PAGE_CACHE_MAX_BYTES, settings.PAGE_CACHE_TTL),
+}
+
+
+def create_page_cache(settings) -> PageCache:
+    """
+    :param settings: settings naming the backend in PAGE_CACHE_BACKEND
+    :return: page cache for the configured backend
+    """
+    if settings.PAGE_CACHE_BACKEND not in PAGE_CACHE_BACKENDS:
+        raise RuntimeError('unknown page cache backend "{}", choose from: {}'.format(
+            settings.PAGE_CACHE_BACKEND, ', '.join(sorted(PAGE_CACHE_BACKENDS))))
+    return PAGE_CACHE_BACKENDS[settings.PAGE_CACHE_BACKEND](settings)
+
+
+# keys include the diary version, a save in any worker bumps it so that no worker serves the page from before. This
+# drops all cached pages of the diary rather than only those of the saved month and year, but needs no shared
+# invalidation between workers
+def month_page_key(user_id: int, diary_version: int, year: int, month: int) -> tuple:
+    return ('diary-month', user_id, diary_version, year, month)
+
+
+def year_page_key(user_id: int, diary_version: int, year: int) -> tuple:
+    return ('diary-year', user_id, diary_version, year)
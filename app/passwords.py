@@ -0,0 +1,55 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from passlib.hash import pbkdf2_sha256
+
+
+class PasswordHasherBusy(Exception):
+    """ Raised when too many passwords are already waiting to be hashed or verified """
+
+
+def _hash(password):
+    return pbkdf2_sha256.hash(password)
+
+
+def _verify(password, password_hash):
+    return pbkdf2_sha256.verify(password, password_hash)
+
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords in an executor so the CPU heavy pbkdf2 rounds don't block the event loop.
+
+    At most max_pending calls may be queued or running at once, further calls fail fast with PasswordHasherBusy
+    instead of piling up behind a burst of logins.
+    """
+    def __init__(self, loop, workers: int, max_pending: int, use_processes: bool = False):
+        """
+        :param loop: event loop to run the executor calls from
+        :param workers: number of threads or processes doing the hashing
+        :param max_pending: maximum number of hash/verify calls queued or running
+        :param use_processes: use a process pool instead of a thread pool
+        """
+        self.loop = loop
+        self.max_pending = max_pending
+        self.pending = 0
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self.executor = executor_class(max_workers=workers)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._run(_verify, password, password_hash)
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            raise PasswordHasherBusy('{} password hashes already pending'.format(self.pending))
+
+        self.pending += 1
+        try:
+            return await self.loop.run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,264 @@
+"""
+Query builders shared by the views, management commands and benchmarks.
+
+Each selects only the columns its callers use, diary moments and user profiles can be long and every extra column is
+read, sent and decoded for nothing. tests/test_queries.py holds them to their column sets.
+"""
+import datetime
+
+from sqlalchemy import Integer, and_, cast, extract, func, select, true, tuple_, union_all
+
+from .models import (SEARCH_CONFIG, InviteStatus, diary_moments_tsv, sa_diary_entries, sa_diary_invites, sa_diary_rollups,
+                     sa_family_feed, sa_user_sessions, sa_users)
+
+# matches in search snippets are wrapped in <mark> tags, the rest of the snippet still needs escaping
+SNIPPET_OPTIONS = 'StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=30, MinWords=10'
+
+
+def diary_entry(user_id: int, date: datetime.date):
+    """
+    Moments of a user's diary entry for one day.
+
+    :param user_id: owner of the diary entry
+    :param date: day of the entry
+    """
+    return select([sa_diary_entries.c.moments]).where(and_(
+        sa_diary_entries.c.user_id == user_id,
+        sa_diary_entries.c.created_on == date,
+    ))
+
+
+def diary_entries(user_id: int, start_date: datetime.date, end_date: datetime.date):
+    """
+    Days and highlights of a user's diary entries within a date range, ordered by day.
+
+    :param user_id: owner of the diary entries
+    :param start_date: first day of the range
+    :param end_date: day after the last day of the range
+    """
+    return select([sa_diary_entries.c.created_on, sa_diary_entries.c.highlights]).where(and_(
+        sa_diary_entries.c.user_id == user_id,
+        sa_diary_entries.c.created_on >= start_date,
+        sa_diary_entries.c.created_on < end_date,
+    )).order_by(sa_diary_entries.c.created_on)
+
+
+def diary_entries_after(user_id: int, after_date, limit: int):
+    """
+    Next page of a user's diary entries ordered by day, for keyset pagination.
+
+    :param user_id: owner of the diary entries
+    :param after_date: day of the last entry of the previous page, or None for the first page
+    :param limit: number of entries per page
+    """
+    query = select([
+        sa_diary_entries.c.created_on,
+        sa_diary_entries.c.highlights,
+        sa_diary_entries.c.moments,
+    ]).where(sa_diary_entries.c.user_id == user_id)
+
+    if after_date is not None:
+        query = query.where(sa_diary_entries.c.created_on > after_date)
+
+    return query.order_by(sa_diary_entries.c.created_on).limit(limit)
+
+
+def diary_entries_before(user_id: int, before_date, limit: int, moments: bool = False):
+    """
+    Next page of a user's diary entries from the newest day back, for keyset pagination of the timeline.
+
+    :param user_id: owner of the diary entries
+    :param before_date: day of the last entry of the previous page, or None for the first page
+    :param limit: number of entries per page
+    :param moments: also select the full moments text, not only highlights
+    """
+    columns = [sa_diary_entries.c.created_on, sa_diary_entries.c.highlights]
+    if moments:
+        columns.append(sa_diary_entries.c.moments)
+    query = select(columns).where(sa_diary_entries.c.user_id == user_id)
+
+    if before_date is not None:
+        query = query.where(sa_diary_entries.c.created_on < before_date)
+
+    return query.order_by(sa_diary_entries.c.created_on.desc()).limit(limit)
+
+
+def search_diary(user_id: int, terms: str, limit: int, offset: int = 0):
+    """
+    Diary entries of a user matching search terms, best matches first, as (created_on, rank, snippet) rows.
+
+    Snippets are made by ts_headline which has to parse the whole moments text, so only for the entries of the page.
+
+    :param user_id: owner of the diary entries
+    :param terms: search terms in websearch_to_tsquery syntax, e.g. 'walk "made dinner" -pizza'
+    :param limit: number of entries per page
+    :param offset: number of entries of the previous pages
+    """
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, terms)
+    rank = func.ts_rank_cd(diary_moments_tsv, tsquery)
+    hits = select([
+        sa_diary_entries.c.created_on,
+        sa_diary_entries.c.moments,
+        rank.label('rank'),
+    ]).where(and_(
+        sa_diary_entries.c.user_id == user_id,
+        diary_moments_tsv.op('@@')(tsquery),
+    )).order_by(rank.desc(), sa_diary_entries.c.created_on.desc()).limit(limit).offset(offset).alias('hits')
+
+    snippet = func.ts_headline(SEARCH_CONFIG, hits.c.moments, tsquery, SNIPPET_OPTIONS)
+    return select([hits.c.created_on, hits.c.rank, snippet.label('snippet')]).order_by(
+        hits.c.rank.desc(), hits.c.created_on.desc())
+
+
+def family_feed(guest_id: int, before: tuple, limit: int):
+    """
+    Page of a guest's family feed, newest day first, as (owner_id, owner_name, created_on, highlights) rows.
+
+    Entries of most owners were copied into family_feed by Day.post, those of owners with family_feed_pull set are
+    pulled from diary_entries, a page per owner that are then merged. Both halves are read with keyset pagination on
+    (created_on, owner_id).
+
+    :param guest_id: user reading the feed
+    :param before: (created_on, owner_id) of the last item of the previous page, or None for the first page
+    :param limit: number of items per page
+    """
+    pushed = select([
+        sa_family_feed.c.owner_id,
+        sa_family_feed.c.created_on,
+        sa_family_feed.c.highlights,
+    ]).where(sa_family_feed.c.guest_id == guest_id)
+
+    pull_owners = select([sa_diary_invites.c.user_id.label('owner_id')]).select_from(
+        sa_diary_invites.join(sa_users, sa_users.c.id == sa_diary_invites.c.user_id)
+    ).where(and_(
+        sa_diary_invites.c.guest_id == guest_id,
+        sa_diary_invites.c.status == InviteStatus.Accepted,
+        sa_users.c.family_feed_pull,
+    )).distinct().alias('pull_owners')
+    # the newest entries of each pull owner are read on their own, from the end of the owner's
+    # (user_id, created_on) index, rather than sorting the entries of all pull owners together
+    owner_entries = select([
+        sa_diary_entries.c.created_on,
+        sa_diary_entries.c.highlights,
+    ]).where(sa_diary_entries.c.user_id == pull_owners.c.owner_id)
+
+    if before is not None:
+        pushed = pushed.where(tuple_(sa_family_feed.c.created_on, sa_family_feed.c.owner_id) < tuple_(*before))
+        # created_on <= bounds the index scan, the row comparison alone would only filter it
+        owner_entries = owner_entries.where(and_(
+            sa_diary_entries.c.created_on <= before[0],
+            tuple_(sa_diary_entries.c.created_on, sa_diary_entries.c.user_id) < tuple_(*before),
+        ))
+
+    owner_entries = owner_entries.order_by(sa_diary_entries.c.created_on.desc()).limit(limit).lateral('owner_entries')
+    pulled = select([
+        pull_owners.c.owner_id,
+        owner_entries.c.created_on,
+        owner_entries.c.highlights,
+    ]).select_from(pull_owners.join(owner_entries, true()))
+
+    pushed = pushed.order_by(sa_family_feed.c.created_on.desc(), sa_family_feed.c.owner_id.desc()).limit(limit)
+    pulled = pulled.order_by(owner_entries.c.created_on.desc(), pull_owners.c.owner_id.desc()).limit(limit)
+    feed = union_all(select([pushed.alias('pushed')]), select([pulled.alias('pulled')])).alias('feed')
+
+    return select([
+        feed.c.owner_id,
+        sa_users.c.name.label('owner_name'),
+        feed.c.created_on,
+        feed.c.highlights,
+    ]).select_from(feed.join(sa_users, sa_users.c.id == feed.c.owner_id)).order_by(
+        feed.c.created_on.desc(), feed.c.owner_id.desc()).limit(limit)
+
+
+def monthly_counts(user_id: int, year: int, use_rollups: bool = True):
+    """
+    Number of diary entries per month of a year, as (month, entries) rows.
+
+    :param user_id: owner of the diary entries
+    :param year: year to count entries for
+    :param use_rollups: read diary_rollups rather than aggregating diary_entries in Postgres
+    """
+    if use_rollups:
+        return select([sa_diary_rollups.c.month, sa_diary_rollups.c.entries]).where(and_(
+            sa_diary_rollups.c.user_id == user_id,
+            sa_diary_rollups.c.year == year,
+        ))
+
+    month = cast(extract('month', sa_diary_entries.c.created_on), Integer)
+    return select([month.label('month'), func.count().label('entries')]).where(and_(
+        sa_diary_entries.c.user_id == user_id,
+        sa_diary_entries.c.created_on >= datetime.date(year, 1, 1),
+        sa_diary_entries.c.created_on < datetime.date(year + 1, 1, 1),
+    )).group_by(month)
+
+
+def yearly_counts(user_id: int, use_rollups: bool = True):
+    """
+    Number of diary entries per year, as (year, entries) rows.
+
+    :param user_id: owner of the diary entries
+    :param use_rollups: read diary_rollups rather than aggregating diary_entries in Postgres
+    """
+    if use_rollups:
+        return select([
+            sa_diary_rollups.c.year,
+            func.sum(sa_diary_rollups.c.entries).label('entries'),
+        ]).where(sa_diary_rollups.c.user_id == user_id).group_by(sa_diary_rollups.c.year)
+
+    year = cast(extract('year', sa_diary_entries.c.created_on), Integer)
+    return select([year.label('year'), func.count().label('entries')]).where(
+        sa_diary_entries.c.user_id == user_id
+    ).group_by(year)
+
+
+def diary_version(user_id: int):
+    """
+    Version counter and last modification time of a user's diary, as a single row.
+
+    :param user_id: owner of the diary
+    """
+    return select([sa_users.c.diary_version, sa_users.c.diary_modified_on]).where(sa_users.c.id == user_id)
+
+
+def user_name(user_id: int):
+    """
+    Name of a user, as a single row.
+
+    :param user_id: id of the user
+    """
+    return select([sa_users.c.name]).where(sa_users.c.id == user_id)
+
+
+def user_credentials(email: str):
+    """
+    Id and password hash of the user with an email, as a single row.
+
+    :param email: email the user logs in with
+    """
+    return select([sa_users.c.id, sa_users.c.password]).where(sa_users.c.email == email)
+
+
+def session_user_id(session_id: str, client_ip: str, created_after: datetime.datetime):
+    """
+    User id of a session that has not expired yet.
+
+    :param session_id: id of the session, as stored in the session cookie
+    :param client_ip: client IP the session was created from
+    :param created_after: creation time before which sessions are expired
+    """
+    return select([sa_user_sessions.c.user_id]).where(and_(
+        sa_user_sessions.c.id == session_id,
+        sa_user_sessions.c.client_ip == client_ip,
+        sa_user_sessions.c.created_on > created_after,
+    ))
+
+
+def delete_expired_sessions(created_before: datetime.datetime, limit: int):
+    """
+    Delete up to limit sessions created before a time.
+
+    :param created_before: creation time before which sessions are expired
+    :param limit: maximum number of sessions deleted
+    """
+    expired = select([sa_user_sessions.c.id]).where(sa_user_sessions.c.created_on < created_before).limit(limit)
+    return sa_user_sessions.delete().where(sa_user_sessions.c.id.in_(expired))
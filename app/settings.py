@@ -24,9 +24,66 @@ class Settings:
     DB_PASSWORD = Required(str)
     DB_HOST = 'localhost'
     DB_PORT = '5432'
-    # you should replace this with another value via the environment variable APP_COOKIE_SECRET
-    # which is not saved in code, you could also use Required(str) to force the env variable to be set.
-    COOKIE_SECRET = 'ZDNwtK36flrr1pzWfmF8qxWmiocFG3pHIZuBSOL-ELs='
+    DB_POOL_MINSIZE = 1
+    DB_POOL_MAXSIZE = 10
+    # seconds to wait for a free pooled connection before answering 503
+    DB_ACQUIRE_TIMEOUT = 5
+    # milliseconds before postgres cancels a statement, 0 to disable
+    DB_STATEMENT_TIMEOUT = 10000
+    # seconds between pool usage log lines, 0 to disable
+    DB_POOL_STATS_INTERVAL = 0
+    # milliseconds after which a request gets logged as slow, 0 to disable
+    SLOW_REQUEST_THRESHOLD = 0
+    # /metrics is only served to requests with an "Authorization: Bearer <METRICS_TOKEN>" header, and not at all
+    # while it is empty
+    METRICS_TOKEN = ''
+    # rendered month and year pages, 'local' caches them per worker which is why they also expire after the TTL
+    PAGE_CACHE_BACKEND = 'local'
+    PAGE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    PAGE_CACHE_TTL = 300
+    # server side sessions, 'local' keeps them per worker in front of user_sessions, so a logout in another worker
+    # is only seen once the entry expires
+    SESSION_STORE_BACKEND = 'local'
+    SESSION_CACHE_SIZE = 10000
+    SESSION_CACHE_TTL = 60
+    # seconds between sweeps of expired sessions from the session store, 0 to disable
+    SESSION_SWEEP_INTERVAL = 60
+    # seconds a login lasts, older user_sessions rows are deleted every REAP_INTERVAL seconds (0 to disable) in
+    # batches of REAP_BATCH_SIZE rows
+    SESSION_TTL = 30 * 24 * 3600
+    SESSION_REAP_INTERVAL = 3600
+    SESSION_REAP_BATCH_SIZE = 1000
+    # per worker cache of the diaries each guest was invited to, an invite changed in another worker is only seen
+    # once the entry expires
+    FAMILY_CACHE_SIZE = 10000
+    FAMILY_CACHE_TTL = 60
+    # diary highlights are copied into the family feed of each guest when written, owners with more guests than
+    # FANOUT_LIMIT have their entries pulled when guests read the feed instead, newly accepted guests get the
+    # last BACKFILL_DAYS of entries
+    FAMILY_FEED_FANOUT_LIMIT = 25
+    FAMILY_FEED_BACKFILL_DAYS = 30
+    FAMILY_FEED_PAGE_SIZE = 30
+    # live family updates on /family/live, each worker LISTENs on one connection of its pool which is checked after
+    # PING_INTERVAL quiet seconds, guests with more than QUEUE_SIZE unsent updates are disconnected
+    LIVE_UPDATES = True
+    LIVE_QUEUE_SIZE = 32
+    LIVE_PING_INTERVAL = 30
+    LIVE_RETRY_INTERVAL = 5
+    # read diary counts from diary_rollups, otherwise they are aggregated from diary_entries by Postgres
+    DIARY_ROLLUPS = True
+    # pbkdf2 runs in a pool so logins don't block the event loop, calls beyond MAX_PENDING are rejected
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_MAX_PENDING = 32
+    PASSWORD_HASH_PROCESSES = False
+    # login attempts allowed per minute, and in a single burst, per client IP and per email
+    LOGIN_IP_RATE = 20
+    LOGIN_IP_BURST = 40
+    LOGIN_EMAIL_RATE = 5
+    LOGIN_EMAIL_BURST = 10
+    # largest diary upload accepted by /diary/import, in bytes, and number of imports run at once per worker, each
+    # holds a database connection of its own next to the pool
+    IMPORT_MAX_BYTES = 50 * 1024 * 1024
+    IMPORT_WORKERS = 2
 
     def __init__(self, **custom_settings):
         """
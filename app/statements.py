@@ -0,0 +1,60 @@
+"""
+Hot path statements, built once from the query builders with bindparam placeholders and compiled for the engine's
+dialect at startup, so that requests only bind parameters instead of building and compiling SQLAlchemy expressions.
+
+Compiled statements are executed as plain SQL, aiopg then skips SQLAlchemy's result processing too. That is only
+fine for columns psycopg2 already converts, e.g. not for Enum columns.
+"""
+from sqlalchemy import bindparam
+
+from . import queries
+
+
+class Statement:
+    def __init__(self, query):
+        """
+        :param query: SQLAlchemy Core statement with bindparam placeholders for every parameter
+        """
+        self.query = query
+        self.sql = None
+        self.defaults = {}
+
+    def compile(self, dialect):
+        """ Compile the statement, keeping the values of binds that are constants of the query, e.g. limits """
+        compiled = self.query.compile(dialect=dialect)
+        self.sql = str(compiled)
+        self.defaults = {compiled.bind_names[bind]: bind.effective_value
+                         for bind in compiled.binds.values() if not bind.required}
+
+    def params(self, **params) -> dict:
+        return dict(self.defaults, **params) if self.defaults else params
+
+    def execute(self, conn, **params):
+        """
+        :param conn: aiopg.sa connection
+        :param params: values of the bindparam placeholders
+        :return: the connection's execute coroutine
+        """
+        if self.sql is None:
+            raise RuntimeError('statements are not compiled yet, see compile_statements')
+        return conn.execute(self.sql, self.params(**params))
+
+
+diary_version = Statement(queries.diary_version(bindparam('user_id')))
+diary_entry = Statement(queries.diary_entry(bindparam('user_id'), bindparam('date')))
+diary_entries = Statement(queries.diary_entries(bindparam('user_id'), bindparam('start_date'), bindparam('end_date')))
+monthly_counts = Statement(queries.monthly_counts(bindparam('user_id'), bindparam('year')))
+yearly_counts = Statement(queries.yearly_counts(bindparam('user_id')))
+user_name = Statement(queries.user_name(bindparam('user_id')))
+session_user_id = Statement(queries.session_user_id(
+    bindparam('session_id'), bindparam('client_ip'), bindparam('created_after')))
+
+STATEMENTS = [diary_version, diary_entry, diary_entries, monthly_counts, yearly_counts, user_name, session_user_id]
+
+
+def compile_statements(dialect):
+    """
+    :param dialect: dialect of the engine the statements run on, e.g. app['pg_engine'].dialect
+    """
+    for statement in STATEMENTS:
+        statement.compile(dialect)
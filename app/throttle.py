@@ -0,0 +1,84 @@
+import time
+
+
+class TokenBuckets:
+    """
+    Token bucket rate limiter keyed by an arbitrary hashable, e.g. a client IP or an email.
+
+    Every key holds up to burst tokens which refill at rate tokens per minute, each attempt takes one. Only keys seen
+    recently are kept: buckets that have refilled completely are indistinguishable from new ones and get evicted
+    during the periodic sweep.
+    """
+    def __init__(self, rate: int, burst: int, sweep_interval: int = 60, timer=time.monotonic):
+        """
+        :param rate: tokens added per minute
+        :param burst: maximum number of tokens a bucket holds
+        :param sweep_interval: minimum number of seconds between sweeps of refilled buckets
+        :param timer: clock used for refilling, useful when testing
+        """
+        self.rate = rate / 60
+        self.burst = burst
+        self.sweep_interval = sweep_interval
+        self.timer = timer
+        self.allowed = 0
+        self.rejected = 0
+        self._buckets = {}
+        self._last_sweep = timer()
+
+    def consume(self, key) -> bool:
+        """
+        Take a token from the bucket of key.
+
+        :return: whether a token was available, i.e. whether the attempt is allowed
+        """
+        now = self.timer()
+        if now - self._last_sweep >= self.sweep_interval:
+            self.sweep(now)
+
+        tokens, updated_on = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_on) * self.rate)
+
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            self.rejected += 1
+            return False
+
+        self._buckets[key] = (tokens - 1, now)
+        self.allowed += 1
+        return True
+
+    def sweep(self, now=None):
+        """ Evict buckets that have refilled completely since they were last used """
+        now = self.timer() if now is None else now
+        full_after = self.burst / self.rate if self.rate else float('inf')
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if now - bucket[1] < full_after}
+        self._last_sweep = now
+
+    def stats(self) -> dict:
+        """ :return: counters suitable for reporting as metrics """
+        return {
+            'keys': len(self._buckets),
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+        }
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class LoginThrottle:
+    """
+    Limits login attempts per client IP and per email, so brute forcing is rejected before any DB or hashing work.
+    """
+    def __init__(self, ip_rate: int, ip_burst: int, email_rate: int, email_burst: int):
+        self.ips = TokenBuckets(ip_rate, ip_burst)
+        self.emails = TokenBuckets(email_rate, email_burst)
+
+    def allow(self, client_ip: str, email: str) -> bool:
+        return self.ips.consume(client_ip) and self.emails.consume(email.strip().lower())
+
+    def stats(self) -> dict:
+        return {
+            'ip': self.ips.stats(),
+            'email': self.emails.stats(),
+        }
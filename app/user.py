@@ -1,14 +1,140 @@
-from datetime import datetime
+from abc import ABC, abstractmethod
+import asyncio
+from datetime import datetime, timedelta
 import logging
-import uuid
+import secrets
+import time
 
-from aiohttp_session import get_session
 import sqlalchemy as sa
 
+from app.cache import TTLCache
+from app.db import connection
 from app.models import sa_user_sessions
+from app import statements
+from app.queries import delete_expired_sessions
 
 log = logging.getLogger(__name__)
 
+# the cookie only holds the random session id, there is nothing in it worth encrypting
+SESSION_COOKIE = 'POF_SESSION'
+
+
+class SessionStore(ABC):
+    """
+    Interface for server side session stores, mapping (session id, client ip) straight to the user id.
+
+    user_sessions remains the durable record of sessions, the store answers most lookups without decrypting a cookie
+    or querying it. Methods are coroutines so that a store shared by all gunicorn workers, e.g. on memcached or redis,
+    can be plugged in through the SESSION_STORE_BACKEND setting.
+    """
+    @abstractmethod
+    async def get(self, key: tuple):
+        """ :return: user id of the session, or None """
+
+    @abstractmethod
+    async def set(self, key: tuple, user_id: int):
+        """ Store the user id of a new session """
+
+    @abstractmethod
+    async def delete(self, key: tuple):
+        """ Forget a session, e.g. on logout """
+
+    @abstractmethod
+    async def sweep(self) -> int:
+        """
+        Remove expired sessions, called periodically by sweep_sessions.
+
+        :return: number of sessions removed
+        """
+
+
+class LocalSessionStore(SessionStore):
+    """
+    Session store held in the memory of a single worker, a logout in another worker is only seen once the entry
+    expires after ttl seconds.
+    """
+    def __init__(self, maxsize: int, ttl: int, timer=time.monotonic):
+        self.sessions = TTLCache(maxsize, ttl, timer)
+
+    async def get(self, key):
+        return self.sessions.get(key)
+
+    async def set(self, key, user_id):
+        self.sessions.set(key, user_id)
+
+    async def delete(self, key):
+        self.sessions.pop(key)
+
+    async def sweep(self):
+        return self.sessions.expire()
+
+    def stats(self) -> dict:
+        return self.sessions.stats()
+
+
+SESSION_STORE_BACKENDS = {
+    'local': lambda settings: LocalSessionStore(settings.SESSION_CACHE_SIZE, settings.SESSION_CACHE_TTL),
+}
+
+
+def create_session_store(settings) -> SessionStore:
+    """
+    :param settings: settings naming the backend in SESSION_STORE_BACKEND
+    :return: session store for the configured backend
+    """
+    if settings.SESSION_STORE_BACKEND not in SESSION_STORE_BACKENDS:
+        raise RuntimeError('unknown session store backend "{}", choose from: {}'.format(
+            settings.SESSION_STORE_BACKEND, ', '.join(sorted(SESSION_STORE_BACKENDS))))
+    return SESSION_STORE_BACKENDS[settings.SESSION_STORE_BACKEND](settings)
+
+
+async def sweep_sessions(store: SessionStore, interval: int):
+    """ Remove expired sessions from the store every interval seconds until cancelled """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            expired = await store.sweep()
+            if expired:
+                log.debug('swept %d expired sessions', expired)
+        except Exception as e:
+            log.error(e, exc_info=1)
+
+
+async def reap_sessions(engine, ttl: int, interval: int, batch_size: int):
+    """
+    Delete sessions older than ttl seconds from user_sessions every interval seconds until cancelled.
+
+    Rows go in batches of batch_size, each in its own statement on a freshly acquired connection, so a large
+    backlog neither holds long locks nor keeps a pooled connection from the requests.
+    """
+    while True:
+        try:
+            reaped = 0
+            deleted = batch_size
+            while deleted == batch_size:
+                async with engine.acquire() as conn:
+                    result = await conn.execute(delete_expired_sessions(
+                        datetime.utcnow() - timedelta(seconds=ttl), batch_size))
+                    deleted = result.rowcount
+                reaped += deleted
+
+            if reaped:
+                log.info('reaped %d expired sessions', reaped)
+        except Exception as e:
+            log.error(e, exc_info=1)
+
+        await asyncio.sleep(interval)
+
+
+async def set_session_cookie(request, response):
+    """ on_response_prepare signal handler writing the cookie of sessions created or deleted by the request """
+    if 'session_cookie' in request:
+        if request['session_cookie']:
+            response.set_cookie(SESSION_COOKIE, request['session_cookie'], path='/', httponly=True,
+                                max_age=request.app['settings'].SESSION_TTL)
+        else:
+            response.del_cookie(SESSION_COOKIE, path='/')
+
 
 class UserSession:
     def __init__(self, request):
@@ -19,27 +145,35 @@ class UserSession:
 
     async def user_id(self):
         """ Returns the user ID of the session """
-        session = await get_session(self.request)
-        session_id = session.get('session_id')
+        session_id = self.request.cookies.get(SESSION_COOKIE)
 
         if session_id:
-            client_ip = self.client_ip()
+            key = (session_id, self.client_ip()[:32])
+            store = self.request.app['session_store']
+
+            user_id = await store.get(key)
+            if user_id is not None:
+                return user_id
 
-            async with self.request.app['pg_engine'].acquire() as conn:
-                result = await conn.execute(
-                    sa.select([sa_user_sessions.c.user_id]).where(sa_user_sessions.c.id == session_id)
-                                                           .where(sa_user_sessions.c.client_ip == client_ip))
-                return await result.scalar()
+            # sessions created by another worker or before a restart
+            ttl = self.request.app['settings'].SESSION_TTL
+            async with connection(self.request) as conn:
+                result = await statements.session_user_id.execute(
+                    conn, session_id=session_id, client_ip=key[1], created_after=datetime.utcnow() - timedelta(seconds=ttl))
+                user_id = await result.scalar()
+
+            if user_id is not None:
+                await store.set(key, user_id)
+
+            return user_id
 
     async def create(self, user_id):
         """ Creates the session ID """
-        session = await get_session(self.request)
-
-        session_id = str(uuid.uuid4())
+        session_id = secrets.token_urlsafe(32)
         client_ip = self.client_ip()[:32]
         client_agent = self.request.headers.get('User-Agent', '')[:256]
 
-        async with self.request.app['pg_engine'].acquire() as conn:
+        async with connection(self.request) as conn:
             await conn.execute(sa_user_sessions.insert().values(
                 id=session_id,
                 user_id=user_id,
@@ -48,21 +182,22 @@ class UserSession:
                 created_on=datetime.utcnow(),
             ))
 
-        session['session_id'] = session_id
+        await self.request.app['session_store'].set((session_id, client_ip), user_id)
+        self.request['session_cookie'] = session_id
 
     async def delete(self):
         """ Deletes the session ID """
-        session = await get_session(self.request)
-
-        session_id = session.pop('session_id', None)
+        session_id = self.request.cookies.get(SESSION_COOKIE)
         client_ip = self.client_ip()[:32]
 
         if session_id:
+            self.request['session_cookie'] = ''
+            await self.request.app['session_store'].delete((session_id, client_ip))
             try:
-                async with self.request.app['pg_engine'].acquire() as conn:
+                async with connection(self.request) as conn:
                     await conn.execute(sa_user_sessions.delete().where(sa.and_(
-                        id=session_id,
-                        client_ip=client_ip,
+                        sa_user_sessions.c.id == session_id,
+                        sa_user_sessions.c.client_ip == client_ip,
                     )))
             except Exception as e:
                 log.error(e)
@@ -1,7 +1,8 @@
 from aiohttp_jinja2 import template
 
 from .user import UserSession
-from ..models import sa_users
+from ..db import connection
+from .. import statements
 
 
 @template('index.jinja')
@@ -17,8 +18,8 @@ async def index(request):
     user = None
 
     if user_id:
-        async with request.app['pg_engine'].acquire() as conn:
-            result = await conn.execute(sa_users.select(sa_users.c.id == user_id))
+        async with connection(request) as conn:
+            result = await statements.user_name.execute(conn, user_id=user_id)
             user = await result.fetchone()
             name = user.name
 
@@ -1,24 +1,134 @@
 from collections import defaultdict
+import csv
 import datetime
+import io
+import json
 import logging
-import re
-
-from aiohttp.web import View, HTTPFound
-from aiohttp_jinja2 import template
-from psycopg2 import IntegrityError
-from sqlalchemy import and_
-from sqlalchemy.orm.exc import NoResultFound
-
-from ..models import sa_diary_entries
+import tempfile
+
+from aiohttp.web import (View, ContentCoding, HTTPBadRequest, HTTPForbidden, HTTPFound, HTTPNotModified,
+                         HTTPRequestEntityTooLarge, Response, StreamResponse, json_response)
+from aiohttp_jinja2 import render_template, template
+from markupsafe import Markup, escape
+from psycopg2 import Error
+from sqlalchemy import literal_column
+from sqlalchemy.dialects.postgresql import insert
+
+from ..db import PoolTimeout, blocking_connection, connection, release_connection
+from ..diary_import import FORMATS, UPLOAD_ERRORS, import_diary
+from ..family import fan_out
+from ..highlights import highlight
+from ..live import notify_entry
+from ..models import sa_diary_entries, sa_diary_rollups, sa_users
+from ..page_cache import month_page_key, year_page_key
+from .. import statements
+from ..queries import diary_entries_after, diary_entries_before, monthly_counts, search_diary, yearly_counts
 from ..user import UserSession
 
 log = logging.getLogger(__name__)
-DOUBLE_NEWLINE_RE = re.compile('(?:\r?\n){2}')
-ENDING_CHARS_RE = re.compile('[!.]')
-TRAIL_CHARS_RE = re.compile('[:-]')
+
+
+async def add_version_headers(request, response):
+    """ on_response_prepare signal handler adding the validators found by DiaryView.not_modified """
+    if response.status == 200 and 'diary_etag' in request:
+        response.headers['ETag'] = request['diary_etag']
+        response.headers['Cache-Control'] = 'private, no-cache'
+        if request['diary_modified_on']:
+            response.last_modified = request['diary_modified_on']
+
+
+def _opaque_tag(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
 
 
 class DiaryView(View):
+    async def not_modified(self, user_id, daily: bool = False):
+        """
+        Compare the user's diary version with the request's validators.
+
+        :param user_id: owner of the diary shown
+        :param daily: whether the page also changes with the current date
+        :return: 304 response if the client's copy is still current, otherwise None after remembering the
+                 validators for add_version_headers
+        """
+        if not user_id:
+            return
+
+        async with connection(self.request) as conn:
+            result = await statements.diary_version.execute(conn, user_id=user_id)
+            version = await result.first()
+
+        if version is None:
+            return
+
+        etag = 'W/"{}.{}{}"'.format(user_id, version.diary_version,
+                                    datetime.date.today().strftime('.%Y%m%d') if daily else '')
+        modified_on = version.diary_modified_on
+
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            # If-None-Match uses the weak comparison, a tag matches whether or not either side is marked W/
+            tags = {_opaque_tag(tag) for tag in if_none_match.split(',')}
+            current = '*' in tags or _opaque_tag(etag) in tags
+        else:
+            if_modified_since = self.request.if_modified_since
+            current = False
+            if not daily and modified_on is not None and if_modified_since is not None:
+                current = modified_on.replace(microsecond=0, tzinfo=datetime.timezone.utc) <= if_modified_since
+
+        if current:
+            return HTTPNotModified(headers={'ETag': etag, 'Cache-Control': 'private, no-cache'})
+
+        self.request['diary_etag'] = etag
+        self.request['diary_modified_on'] = modified_on
+        self.request['diary_version'] = version.diary_version
+
+    async def diary_owner(self, user_id):
+        """
+        :param user_id: user requesting the page
+        :return: owner of the diary requested, the user unless it is one of the family urls
+        :raise HTTPForbidden: when the user has no accepted invite to the owner's diary
+        """
+        owner_id = self.shared_owner_id()
+        if owner_id is None:
+            return user_id
+
+        if not await self.request.app['family_index'].can_read(self.request, user_id, owner_id):
+            raise HTTPForbidden()
+        return owner_id
+
+    def shared_owner_id(self):
+        """ :return: owner of the diary for family urls, None for the user's own diary """
+        owner_id = self.request.match_info.get('owner_id')
+        return int(owner_id) if owner_id is not None else None
+
+    def cacheable(self, user_id, end_date: datetime.date) -> bool:
+        """
+        Only pages of past months and years are cached, entries are mostly written for today. Pages shown to family
+        link to the family urls, those aren't cached so that the owner's cached pages remain the only copy. Pages
+        are cached under the diary version found by not_modified, so they are only cached once that ran.
+        """
+        if not user_id or self.shared_owner_id() is not None or 'diary_version' not in self.request:
+            return False
+        return end_date <= datetime.date.today()
+
+    async def cached_page(self, key):
+        """ :return: response with the cached page for key, or None """
+        if key:
+            body = await self.request.app['page_cache'].get(key)
+            if body is not None:
+                return Response(body=body, content_type='text/html', charset='utf-8')
+
+    async def render_page(self, key, template_name: str, context: dict):
+        """ Render the template and cache it under key unless the page shows a warning """
+        if not key or context.get('warn'):
+            return context
+
+        response = render_template(template_name, self.request, context)
+        await self.request.app['page_cache'].set(key, response.body)
+        return response
+
     def entry_date(self):
         """ Date for requested diary entry """
         # TODO: Need to account for timezone
@@ -42,13 +152,13 @@ class Day(DiaryView):
     @template('diary_entry.jinja')
     async def get(self):
         date = self.entry_date()
-        user_id = await UserSession(self.request).user_id()
+        user_id = await self.diary_owner(await UserSession(self.request).user_id())
+        not_modified = await self.not_modified(user_id, daily=True)
+        if not_modified is not None:
+            return not_modified
 
-        async with self.request.app['pg_engine'].acquire() as conn:
-            result = await conn.execute(sa_diary_entries.select(and_(
-                sa_diary_entries.c.user_id == user_id,
-                sa_diary_entries.c.created_on == date,
-            )))
+        async with connection(self.request) as conn:
+            result = await statements.diary_entry.execute(conn, user_id=user_id, date=date)
             entry = await result.first()
 
         next_day = date + datetime.timedelta(days=1) if date < datetime.date.today() else None
@@ -60,6 +170,7 @@ class Day(DiaryView):
             'day': date,
             'prev_day': date - datetime.timedelta(days=1),
             'next_day': next_day,
+            'owner_id': self.shared_owner_id(),
         }
 
     @template('diary_entry.jinja')
@@ -80,53 +191,54 @@ class Day(DiaryView):
             error = 'Please fill out ' + ', '.join(missing_fields)
 
         if not error:
-            highlights = []
-            for moment in DOUBLE_NEWLINE_RE.split(data['moments']):
-                m = ENDING_CHARS_RE.search(moment)
-                hl_index = m.start() if m else -1
-
-                m = TRAIL_CHARS_RE.search(moment)
-                trail_index = m.start() if m else -1
-                if trail_index > 0 and (hl_index < 0 or trail_index < hl_index):
-                    hl_index = trail_index
-                else:
-                    trail_index = 100
-
-                if hl_index < 0 or hl_index >= trail_index:
-                    highlights.append(moment[:trail_index].strip() + ('...' if len(moment) > trail_index else ''))
-                else:
-                    highlights.append(moment[:hl_index+1].strip())
-
+            highlights = highlight(data['moments'])
+            entry = insert(sa_diary_entries).values(
+                user_id=user_id,
+                created_on=date,
+                highlights=highlights,
+                moments=data['moments'],
+            )
             try:
-                async with self.request.app['pg_engine'].acquire() as conn:
-                    result = await conn.execute(sa_diary_entries.select(and_(
-                        sa_diary_entries.c.user_id == user_id,
-                        sa_diary_entries.c.created_on == date
-                    )))
-                    entry = await result.first()
-                    if not entry:
-                        raise NoResultFound()
-
-                    await conn.execute(sa_diary_entries.update()
-                                       .where(sa_diary_entries.c.id == entry.id)
-                                       .values(
-                                           highlights=' '.join(highlights),
-                                           moments=data['moments']
-                    ))
-
-            except NoResultFound:
-                try:
-                    async with self.request.app['pg_engine'].acquire() as conn:
-                        await conn.execute(sa_diary_entries.insert().values(
-                            user_id=user_id,
-                            created_on=date,
-                            highlights=' '.join(highlights),
-                            moments=data['moments'],
-                        ))
-
-                except IntegrityError as e:
-                    log.error(e)
-                    error = "Oops! Couldn't save for some reason. Please try again later"
+                async with connection(self.request) as conn:
+                    async with conn.begin():
+                        # xmax is only set when the row already existed and got updated
+                        result = await conn.execute(entry.on_conflict_do_update(
+                            constraint='uq_diary_entries_user_id_created_on',
+                            set_={
+                                'highlights': entry.excluded.highlights,
+                                'moments': entry.excluded.moments,
+                            },
+                        ).returning(literal_column('xmax = 0')))
+                        created = await result.scalar()
+
+                        if created:
+                            rollup = insert(sa_diary_rollups).values(
+                                user_id=user_id,
+                                year=date.year,
+                                month=date.month,
+                                entries=1,
+                            )
+                            await conn.execute(rollup.on_conflict_do_update(
+                                index_elements=[sa_diary_rollups.c.user_id, sa_diary_rollups.c.year,
+                                                sa_diary_rollups.c.month],
+                                set_={'entries': sa_diary_rollups.c.entries + 1},
+                            ))
+
+                        # a new diary version also moves cached pages to new keys in every worker, the stale ones age out
+                        result = await conn.execute(sa_users.update().where(sa_users.c.id == user_id).values(
+                            diary_version=sa_users.c.diary_version + 1,
+                            diary_modified_on=datetime.datetime.utcnow(),
+                        ).returning(sa_users.c.family_feed_pull))
+
+                        # guests of heavy writers pull their entries when reading the feed instead
+                        if not await result.scalar():
+                            await fan_out(conn, user_id, date, highlights)
+                        if self.request.app['settings'].LIVE_UPDATES:
+                            await notify_entry(conn, user_id, date, highlights)
+
+            except Error as e:
+                log.error(e)
+                error = "Oops! Couldn't save for some reason. Please try again later"
 
         if error:
             return {
@@ -148,30 +260,42 @@ class Month(DiaryView):
     @template('diary_month.jinja')
     async def get(self):
         start_date, end_date = self.date_range()
-        user_id = await UserSession(self.request).user_id()
+        user_id = await self.diary_owner(await UserSession(self.request).user_id())
+        not_modified = await self.not_modified(user_id)
+        if not_modified is not None:
+            return not_modified
+
+        cache_key = None
+        if self.cacheable(user_id, end_date):
+            cache_key = month_page_key(user_id, self.request['diary_version'], start_date.year, start_date.month)
+        cached = await self.cached_page(cache_key)
+        if cached is not None:
+            return cached
+
         highlights = []
         warn = None
 
         try:
-            async with self.request.app['pg_engine'].acquire() as conn:
-                result = await conn.execute(sa_diary_entries.select(and_(
-                    sa_diary_entries.c.user_id == user_id,
-                    sa_diary_entries.c.created_on >= start_date,
-                    sa_diary_entries.c.created_on < end_date,
-                )))
+            async with connection(self.request) as conn:
+                result = await statements.diary_entries.execute(
+                    conn, user_id=user_id, start_date=start_date, end_date=end_date)
                 async for entry in result:
                     highlights.append((entry.created_on.day, entry.highlights))
 
+        except PoolTimeout:
+            raise
+
         except Exception as e:
             log.error(e, exc_info=1)
             warn = 'Oops. Something is wrong. Please try again later'
 
-        return {
+        return await self.render_page(cache_key, 'diary_month.jinja', {
             'warn': warn,
             'title': self.title.format(start_date),
             'highlights': highlights,
             'date': start_date,
-        }
+            'owner_id': self.shared_owner_id(),
+        })
 
     def date_range(self):
         """ Start and end day of the month (exclusive) for a given date """
@@ -190,30 +314,45 @@ class Year(DiaryView):
     @template('diary_year.jinja')
     async def get(self):
         start_date, end_date = self.date_range()
-        user_id = await UserSession(self.request).user_id()
+        user_id = await self.diary_owner(await UserSession(self.request).user_id())
+        not_modified = await self.not_modified(user_id)
+        if not_modified is not None:
+            return not_modified
+
+        cache_key = None
+        if self.cacheable(user_id, end_date):
+            cache_key = year_page_key(user_id, self.request['diary_version'], start_date.year)
+        cached = await self.cached_page(cache_key)
+        if cached is not None:
+            return cached
+
         highlights = defaultdict(lambda: defaultdict(int))
         warn = None
 
         try:
-            async with self.request.app['pg_engine'].acquire() as conn:
-                result = await conn.execute(sa_diary_entries.select(and_(
-                    sa_diary_entries.c.user_id == user_id,
-                    sa_diary_entries.c.created_on >= start_date,
-                    sa_diary_entries.c.created_on < end_date,
-                )).with_only_columns([sa_diary_entries.c.created_on]))
-                async for entry in result:
-                    highlights[entry.created_on.month][entry.created_on.strftime('%B')] += 1
+            async with connection(self.request) as conn:
+                if self.request.app['settings'].DIARY_ROLLUPS:
+                    result = await statements.monthly_counts.execute(conn, user_id=user_id, year=start_date.year)
+                else:
+                    result = await conn.execute(monthly_counts(user_id, start_date.year, use_rollups=False))
+                async for count in result:
+                    month = datetime.date(start_date.year, count.month, 1)
+                    highlights[count.month][month.strftime('%B')] = count.entries
+
+        except PoolTimeout:
+            raise
 
         except Exception as e:
             log.error(e, exc_info=1)
             warn = 'Oops. Something is wrong. Please try again later'
 
-        return {
+        return await self.render_page(cache_key, 'diary_year.jinja', {
             'warn': warn,
             'title': start_date.year,
             'highlights': highlights,
             'date': start_date,
-        }
+            'owner_id': self.shared_owner_id(),
+        })
 
     def date_range(self):
         """ Start and end day of the year (exclusive) for a given date """
@@ -231,19 +370,25 @@ class MyDiary(DiaryView):
 
     @template('diary.jinja')
     async def get(self):
-        user_id = await UserSession(self.request).user_id()
+        user_id = await self.diary_owner(await UserSession(self.request).user_id())
+        not_modified = await self.not_modified(user_id)
+        if not_modified is not None:
+            return not_modified
+
         highlights = defaultdict(int)
         warn = None
 
         try:
-            async with self.request.app['pg_engine'].acquire() as conn:
-                result = await conn.execute(
-                    sa_diary_entries.select(
-                        sa_diary_entries.c.user_id == user_id
-                    ).with_only_columns(
-                        [sa_diary_entries.c.created_on]))
-                async for entry in result:
-                    highlights[entry.created_on.year] += 1
+            async with connection(self.request) as conn:
+                if self.request.app['settings'].DIARY_ROLLUPS:
+                    result = await statements.yearly_counts.execute(conn, user_id=user_id)
+                else:
+                    result = await conn.execute(yearly_counts(user_id, use_rollups=False))
+                async for count in result:
+                    highlights[count.year] = count.entries
+
+        except PoolTimeout:
+            raise
 
         except Exception as e:
             log.error(e, exc_info=1)
@@ -251,6 +396,238 @@ class MyDiary(DiaryView):
 
         return {
             'warn': warn,
-            'title': 'My Diary',
+            'title': 'My Diary' if self.shared_owner_id() is None else 'Family Diary',
             'highlights': highlights,
+            'owner_id': self.shared_owner_id(),
         }
+
+
+class Search(DiaryView):
+    """
+    This is the view handler for the "/diary/search" url.
+
+    Query parameters: q, the search terms, and page.
+    """
+    per_page = 20
+    max_terms_length = 200
+
+    @template('diary_search.jinja')
+    async def get(self):
+        user_id = await UserSession(self.request).user_id()
+        if not user_id:
+            return HTTPFound(self.request.app.router['login'].url())
+
+        terms = self.request.query.get('q', '').strip()[:self.max_terms_length]
+        try:
+            page = max(1, int(self.request.query.get('page', 1)))
+        except ValueError:
+            raise HTTPBadRequest(text='page must be a number')
+
+        hits = []
+        warn = None
+
+        if terms:
+            try:
+                async with connection(self.request) as conn:
+                    # one extra hit tells whether there is a next page
+                    result = await conn.execute(search_diary(user_id, terms, self.per_page + 1,
+                                                             (page - 1) * self.per_page))
+                    async for hit in result:
+                        hits.append((hit.created_on, self.snippet_html(hit.snippet)))
+
+            except PoolTimeout:
+                raise
+
+            except Exception as e:
+                log.error(e, exc_info=1)
+                warn = 'Oops. Something is wrong. Please try again later'
+
+        return {
+            'warn': warn,
+            'title': 'Search',
+            'terms': terms,
+            'hits': hits[:self.per_page],
+            'page': page,
+            'next_page': page + 1 if len(hits) > self.per_page else None,
+        }
+
+    @staticmethod
+    def snippet_html(snippet: str) -> Markup:
+        """ Escape the moments text of a snippet but keep the <mark> tags around matches """
+        return Markup(str(escape(snippet)).replace('&lt;mark&gt;', '<mark>').replace('&lt;/mark&gt;', '</mark>'))
+
+
+class Timeline(DiaryView):
+    """
+    This is the view handler for the "/diary/timeline" url, a JSON API paging through the diary from the newest day back.
+
+    Query parameters: before, the "next" value of the previous page, limit, and moments=1 to include the full
+    moments text rather than only highlights. Pages are read with keyset pagination on the day of the entry, which
+    is unique per user, so every page costs the same index range scan however far back it is.
+    """
+    default_limit = 50
+    max_limit = 200
+
+    async def get(self):
+        user_id = await UserSession(self.request).user_id()
+        if not user_id:
+            raise HTTPForbidden()
+
+        try:
+            before = self.request.query.get('before')
+            before = datetime.datetime.strptime(before, '%Y-%m-%d').date() if before else None
+            limit = min(self.max_limit, max(1, int(self.request.query.get('limit', self.default_limit))))
+        except ValueError:
+            raise HTTPBadRequest(text='before must be a date as YYYY-MM-DD and limit a number')
+        moments = self.request.query.get('moments') == '1'
+
+        async with connection(self.request) as conn:
+            # one extra entry tells whether there is a next page
+            result = await conn.execute(diary_entries_before(user_id, before, limit + 1, moments))
+            entries = await result.fetchall()
+
+        page = []
+        for entry in entries[:limit]:
+            item = {'date': entry.created_on.isoformat(), 'highlights': entry.highlights}
+            if moments:
+                item['moments'] = entry.moments
+            page.append(item)
+
+        return json_response({
+            'entries': page,
+            'next': page[-1]['date'] if len(entries) > limit else None,
+        })
+
+
+async def iter_diary_entries(request, user_id: int, batch_size: int):
+    """
+    Async iterator over batches of a user's diary entries ordered by day.
+
+    Batches are fetched with keyset pagination so memory use doesn't grow with the size of the diary, and the
+    connection goes back to the pool between batches while the caller is busy with them.
+    """
+    after_date = None
+    while True:
+        async with connection(request) as conn:
+            result = await conn.execute(diary_entries_after(user_id, after_date, batch_size))
+            entries = await result.fetchall()
+        await release_connection(request)
+
+        if not entries:
+            return
+
+        yield entries
+        if len(entries) < batch_size:
+            return
+        after_date = entries[-1].created_on
+
+
+class Export(DiaryView):
+    """
+    This is the view handler for the "/diary/export" url, streaming the whole diary as JSON Lines or CSV.
+
+    Query parameters: format=jsonl|csv (default jsonl) and gzip=1 to compress on the fly.
+    """
+    formats = {
+        'jsonl': 'application/x-ndjson',
+        'csv': 'text/csv',
+    }
+    batch_size = 500
+
+    async def get(self):
+        user_id = await UserSession(self.request).user_id()
+        if not user_id:
+            raise HTTPForbidden()
+
+        export_format = self.request.query.get('format', 'jsonl')
+        if export_format not in self.formats:
+            raise HTTPBadRequest(text='format must be one of: {}'.format(', '.join(sorted(self.formats))))
+
+        response = StreamResponse(headers={
+            'Content-Disposition': 'attachment; filename="diary.{}"'.format(export_format),
+        })
+        response.content_type = self.formats[export_format]
+        response.charset = 'utf-8'
+        response.enable_chunked_encoding()
+        if self.request.query.get('gzip') == '1':
+            response.enable_compression(ContentCoding.gzip)
+        await response.prepare(self.request)
+
+        encode = self.encode_csv if export_format == 'csv' else self.encode_jsonl
+        if export_format == 'csv':
+            response.write(encode([('date', 'highlights', 'moments')]))
+
+        async for entries in iter_diary_entries(self.request, user_id, self.batch_size):
+            response.write(encode((entry.created_on.isoformat(), entry.highlights, entry.moments)
+                                  for entry in entries))
+            await response.drain()
+
+        await response.write_eof()
+        return response
+
+    @staticmethod
+    def encode_jsonl(rows) -> bytes:
+        return ''.join(json.dumps({'date': date, 'highlights': highlights, 'moments': moments}) + '\n'
+                       for date, highlights, moments in rows).encode()
+
+    @staticmethod
+    def encode_csv(rows) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+
+
+class Import(DiaryView):
+    """
+    This is the view handler for the "/diary/import" url, loading a diary uploaded in the format of the export.
+
+    The upload is written to a temporary file and imported with COPY in the import executor, aiopg can't COPY and
+    the parsing and highlighting of a large diary would block the event loop. Uploads beyond IMPORT_WORKERS wait
+    for their turn.
+    """
+    chunk_size = 64 * 1024
+
+    async def post(self):
+        user_id = await UserSession(self.request).user_id()
+        if not user_id:
+            raise HTTPForbidden()
+        await release_connection(self.request)
+
+        settings = self.request.app['settings']
+        reader = await self.request.multipart()
+        field = await reader.next()
+        if field is None or field.name != 'file':
+            raise HTTPBadRequest(text='upload the diary as the "file" field')
+
+        import_format = self.request.query.get('format') or (field.filename or '').rpartition('.')[2]
+        if import_format not in FORMATS:
+            raise HTTPBadRequest(text='format must be one of: {}'.format(', '.join(FORMATS)))
+
+        with tempfile.TemporaryFile() as spool:
+            size = 0
+            chunk = await field.read_chunk(self.chunk_size)
+            while chunk:
+                size += len(chunk)
+                if size > settings.IMPORT_MAX_BYTES:
+                    raise HTTPRequestEntityTooLarge()
+                spool.write(chunk)
+                chunk = await field.read_chunk(self.chunk_size)
+            spool.seek(0)
+
+            try:
+                source = await self.request.app.loop.run_in_executor(
+                    self.request.app['import_executor'], self.import_upload, settings, user_id, spool, import_format)
+            except UPLOAD_ERRORS as e:
+                raise HTTPBadRequest(text=str(e))
+
+        # import_diary bumped the diary version, so no cached page of the diary is served anymore
+        return json_response({'imported': source.rows})
+
+    @staticmethod
+    def import_upload(settings, user_id, spool, import_format):
+        conn = blocking_connection(settings)
+        try:
+            return import_diary(conn, user_id, io.TextIOWrapper(spool, encoding='utf-8', newline=''), import_format,
+                                live_updates=settings.LIVE_UPDATES)
+        finally:
+            conn.close()
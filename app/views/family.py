@@ -0,0 +1,107 @@
+import datetime
+
+from aiohttp.web import View, HTTPBadRequest, HTTPForbidden, HTTPFound, HTTPNotFound, WebSocketResponse
+from aiohttp_jinja2 import template
+
+from ..db import connection, release_connection
+from ..family import load_owner_ids, set_invite_status
+from ..models import InviteStatus
+from ..queries import family_feed
+from ..user import UserSession
+
+
+class Invite(View):
+    """
+    This is the view handler for the "/family/invites/{invite_id}" url, where guests accept or decline an invite to a
+    diary and owners revoke it.
+
+    Form fields: status, either accepted or declined.
+    """
+    statuses = {
+        'accepted': InviteStatus.Accepted,
+        'declined': InviteStatus.Declined,
+    }
+
+    async def post(self):
+        user_id = await UserSession(self.request).user_id()
+        if not user_id:
+            return HTTPFound(self.request.app.router['login'].url())
+
+        data = await self.request.post()
+        status = self.statuses.get(data.get('status'))
+        if status is None:
+            raise HTTPBadRequest(text='status must be one of: {}'.format(', '.join(sorted(self.statuses))))
+
+        owner_id = await set_invite_status(self.request, int(self.request.match_info['invite_id']), user_id, status)
+        if owner_id is None:
+            raise HTTPNotFound()
+
+        if status is InviteStatus.Accepted:
+            return HTTPFound(self.request.app.router['family-diary'].url(parts={'owner_id': owner_id}))
+        return HTTPFound(self.request.app.router['index'].url())
+
+
+class Feed(View):
+    """
+    This is the view handler for the "/family/feed" url, the latest highlights of every diary the user was invited to.
+
+    Query parameters: before, the "next" value of the previous page, as YYYY-MM-DD:owner_id.
+    """
+    @template('family_feed.jinja')
+    async def get(self):
+        user_id = await UserSession(self.request).user_id()
+        if not user_id:
+            return HTTPFound(self.request.app.router['login'].url())
+
+        before = self.request.query.get('before')
+        if before:
+            try:
+                date, owner_id = before.split(':')
+                before = datetime.datetime.strptime(date, '%Y-%m-%d').date(), int(owner_id)
+            except ValueError:
+                raise HTTPBadRequest(text='before must be YYYY-MM-DD:owner_id')
+
+        page_size = self.request.app['settings'].FAMILY_FEED_PAGE_SIZE
+        async with connection(self.request) as conn:
+            # one extra item tells whether there is a next page
+            result = await conn.execute(family_feed(user_id, before or None, page_size + 1))
+            items = await result.fetchall()
+
+        last = items[page_size - 1] if len(items) > page_size else None
+        return {
+            'title': 'Family',
+            'items': items[:page_size],
+            'next': '{:%Y-%m-%d}:{}'.format(last.created_on, last.owner_id) if last else None,
+        }
+
+
+async def live(request):
+    """
+    This is the view handler for the "/family/live" url, a WebSocket on which guests receive the highlights of their
+    family's diaries as they are saved, as JSON messages with owner_id, date and highlights.
+
+    Messages from the client are ignored. Clients that fall behind are closed with code 1013 and should reconnect,
+    reading what they missed from the family feed.
+    """
+    user_id = await UserSession(request).user_id()
+    if not user_id:
+        raise HTTPForbidden()
+
+    # not from the family index, another worker's revoke may not have reached it yet and the socket lives on
+    async with connection(request) as conn:
+        owner_ids = await load_owner_ids(conn, user_id)
+    # the socket may stay open for hours, it must not hold on to a pooled connection
+    await release_connection(request)
+
+    ws = WebSocketResponse()
+    await ws.prepare(request)
+
+    hub = request.app['live_hub']
+    subscriber = hub.subscribe(ws, user_id, owner_ids, request.app.loop)
+    try:
+        async for _ in ws:
+            pass
+    finally:
+        hub.unsubscribe(subscriber)
+
+    return ws
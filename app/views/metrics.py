@@ -0,0 +1,17 @@
+import hmac
+
+from aiohttp import web
+
+from ..metrics import prometheus_text
+
+
+async def metrics(request):
+    """
+    This is the view handler for the "/metrics" url, to be scraped by Prometheus with METRICS_TOKEN as its bearer
+    token. Route names, pool state and login attempts are nothing to show the world.
+    """
+    token = request.app['settings'].METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if not token or not hmac.compare_digest(authorization.encode(), 'Bearer {}'.format(token).encode()):
+        raise web.HTTPForbidden()
+    return web.Response(text=prometheus_text(request.app), content_type='text/plain')
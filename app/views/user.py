@@ -2,11 +2,13 @@ from datetime import datetime
 import logging
 
 from aiohttp.web import View, HTTPFound
-from aiohttp_jinja2 import template
-from passlib.hash import pbkdf2_sha256
+from aiohttp_jinja2 import render_template, template
 from psycopg2 import IntegrityError
 
+from ..db import PoolTimeout, connection, release_connection
 from ..models import sa_users
+from ..passwords import PasswordHasherBusy
+from ..queries import user_credentials
 from ..user import UserSession
 
 log = logging.getLogger(__name__)
@@ -43,15 +45,20 @@ class Join(View):
 
         if not error:
             try:
-                async with self.request.app['pg_engine'].acquire() as conn:
+                password = await self.request.app['password_hasher'].hash(data['password'])
+                async with connection(self.request) as conn:
                     result = await conn.execute(sa_users.insert().values(
                         name=data['name'],
                         email=data['email'],
-                        password=pbkdf2_sha256.hash(data['password']),
+                        password=password,
                         created_on=datetime.utcnow(),
                     ))
                     user_id = await result.scalar()
 
+            except PasswordHasherBusy as e:
+                log.warning(e)
+                error = 'We are a little busy right now. Please try again in a moment.'
+
             except IntegrityError as e:
                 log.debug(e)
                 # TODO: Password reset
@@ -88,20 +95,38 @@ class Login(View):
         error = None
         user = None
 
+        client_ip = UserSession(self.request).client_ip()
+        if not self.request.app['login_throttle'].allow(client_ip, data.get('email', '')):
+            log.warning('Throttled login attempt for %s from %s', data.get('email'), client_ip)
+            response = render_template('login.jinja', self.request, {
+                'warn': 'Too many login attempts. Please try again in a few minutes.',
+                'title': 'Login',
+                'email': data.get('email'),
+            })
+            response.set_status(429)
+            return response
+
         try:
-            async with self.request.app['pg_engine'].acquire() as conn:
-                result = await conn.execute(sa_users.select(
-                    sa_users.c.email == data['email']
-                ))
+            async with connection(self.request) as conn:
+                result = await conn.execute(user_credentials(data['email']))
                 user = await result.first()
 
-            if user and pbkdf2_sha256.verify(data['password'], user.password):
+            # don't hold on to a pooled connection while pbkdf2 runs
+            await release_connection(self.request)
+            if user and await self.request.app['password_hasher'].verify(data['password'], user.password):
                 await UserSession(self.request).create(user.id)
                 return HTTPFound(self.request.app.router['diary'].url())
 
             else:
                 error = 'Incorrect email or password. Please try again.'
 
+        except PasswordHasherBusy as e:
+            log.warning(e)
+            error = 'We are a little busy right now. Please try again in a moment.'
+
+        except PoolTimeout:
+            raise
+
         except Exception as e:
             log.error(e)
             error = 'Uh oh something went wrong. Please try again later.'
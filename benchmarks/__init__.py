@@ -0,0 +1,6 @@
+"""
+Benchmarks, see each module for usage.
+
+Those that need a database run against the one configured by Settings, they seed data for a dedicated
+benchmark user and remove it again when done.
+"""
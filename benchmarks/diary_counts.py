@@ -0,0 +1,87 @@
+"""
+Compare counting a user's diary entries per month (Year view) and per year (MyDiary view) by iterating rows in
+Python, by aggregating in Postgres and by reading diary_rollups.
+
+    python -m benchmarks.diary_counts --years 10 --repeat 100
+"""
+import asyncio
+from collections import defaultdict
+import datetime
+
+from aiopg.sa import create_engine
+import click
+from sqlalchemy import and_
+
+from app.main import pg_dsn
+from app.models import sa_diary_entries
+from app.queries import monthly_counts, yearly_counts
+from app.settings import Settings
+
+from .utils import BENCH_USER_ID, remove_diary, report, seed_diary, timed
+
+
+async def python_monthly_counts(conn, year):
+    counts = defaultdict(int)
+    result = await conn.execute(sa_diary_entries.select(and_(
+        sa_diary_entries.c.user_id == BENCH_USER_ID,
+        sa_diary_entries.c.created_on >= datetime.date(year, 1, 1),
+        sa_diary_entries.c.created_on < datetime.date(year + 1, 1, 1),
+    )).with_only_columns([sa_diary_entries.c.created_on]))
+    async for entry in result:
+        counts[entry.created_on.month] += 1
+    return counts
+
+
+async def python_yearly_counts(conn):
+    counts = defaultdict(int)
+    result = await conn.execute(sa_diary_entries.select(
+        sa_diary_entries.c.user_id == BENCH_USER_ID
+    ).with_only_columns([sa_diary_entries.c.created_on]))
+    async for entry in result:
+        counts[entry.created_on.year] += 1
+    return counts
+
+
+async def sql_counts(conn, query):
+    result = await conn.execute(query)
+    return {row[0]: row[1] async for row in result}
+
+
+async def run(repeat):
+    year = datetime.date.today().year - 1
+    engine = await create_engine(pg_dsn(Settings()))
+
+    async with engine.acquire() as conn:
+        assert dict(await python_monthly_counts(conn, year)) == await sql_counts(
+            conn, monthly_counts(BENCH_USER_ID, year, use_rollups=False))
+        assert dict(await python_yearly_counts(conn)) == await sql_counts(
+            conn, yearly_counts(BENCH_USER_ID, use_rollups=True))
+
+        cases = [
+            ('year view: python', lambda: python_monthly_counts(conn, year)),
+            ('year view: group by', lambda: sql_counts(conn, monthly_counts(BENCH_USER_ID, year, use_rollups=False))),
+            ('year view: rollups', lambda: sql_counts(conn, monthly_counts(BENCH_USER_ID, year))),
+            ('my diary view: python', lambda: python_yearly_counts(conn)),
+            ('my diary view: group by', lambda: sql_counts(conn, yearly_counts(BENCH_USER_ID, use_rollups=False))),
+            ('my diary view: rollups', lambda: sql_counts(conn, yearly_counts(BENCH_USER_ID))),
+        ]
+        for name, fn in cases:
+            report(name, await timed(fn, repeat))
+
+    engine.close()
+    await engine.wait_closed()
+
+
+@click.command()
+@click.option('--years', default=10, help='Years of daily entries to seed')
+@click.option('--repeat', default=100, help='Number of runs per approach')
+def main(years, repeat):
+    print('seeded {} diary entries'.format(seed_diary(years)))
+    try:
+        asyncio.get_event_loop().run_until_complete(run(repeat))
+    finally:
+        remove_diary()
+
+
+if __name__ == '__main__':
+    main()
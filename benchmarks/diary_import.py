@@ -0,0 +1,76 @@
+"""
+Benchmark of bulk diary imports: app.diary_import's COPY into a staging table and single upsert versus one upsert
+statement per entry, which is what importing through Day.post amounts to.
+
+    python -m benchmarks.diary_import --entries 100000 --row-by-row 2000
+
+Row by row is only timed on a subset of the entries as it is too slow for the whole import, its rate is reported.
+"""
+import datetime
+import io
+import json
+import time
+
+import click
+
+from app.db import blocking_connection
+from app.diary_import import import_diary
+from app.highlights import highlight
+from app.settings import Settings
+
+from .utils import BENCH_USER_ID, remove_diary
+
+MOMENTS = 'Went for a walk with the kids. Then made dinner!\n\nRead a story: the one with the dragon.'
+
+
+def generate_jsonl(entries: int) -> str:
+    today = datetime.date.today()
+    return ''.join(json.dumps({'date': (today - datetime.timedelta(days=n)).isoformat(), 'moments': MOMENTS}) + '\n'
+                   for n in range(entries))
+
+
+def row_by_row(conn, lines):
+    """ One transaction per entry, like saving each day through Day.post """
+    for line in lines:
+        entry = json.loads(line)
+        with conn, conn.cursor() as cur:
+            cur.execute('INSERT INTO diary_entries (id, user_id, created_on, highlights, moments) '
+                        "VALUES (nextval('diary_entry_id_seq'), %s, %s, %s, %s) "
+                        'ON CONFLICT ON CONSTRAINT uq_diary_entries_user_id_created_on DO UPDATE '
+                        'SET highlights = excluded.highlights, moments = excluded.moments',
+                        (BENCH_USER_ID, entry['date'], highlight(entry['moments']), entry['moments']))
+
+
+def report(name, elapsed, count):
+    print('{:<12} {:8.1f}ms  {:10.0f} entries/s  ({} entries)'.format(name, elapsed * 1000, count / elapsed, count))
+
+
+@click.command()
+@click.option('--entries', default=100000, help='Number of entries imported')
+@click.option('--row-by-row', 'subset', default=2000, help='Number of entries imported one statement at a time')
+def main(entries, subset):
+    data = generate_jsonl(entries)
+    conn = blocking_connection(Settings())
+    try:
+        remove_diary()
+        start = time.perf_counter()
+        import_diary(conn, BENCH_USER_ID, io.StringIO(data), 'jsonl')
+        report('copy', time.perf_counter() - start, entries)
+
+        # importing over existing days exercises the conflict path as well
+        start = time.perf_counter()
+        import_diary(conn, BENCH_USER_ID, io.StringIO(data), 'jsonl')
+        report('copy again', time.perf_counter() - start, entries)
+
+        remove_diary()
+        start = time.perf_counter()
+        row_by_row(conn, data.splitlines()[:subset])
+        report('row by row', time.perf_counter() - start, subset)
+
+    finally:
+        conn.close()
+        remove_diary()
+
+
+if __name__ == '__main__':
+    main()
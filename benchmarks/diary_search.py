@@ -0,0 +1,123 @@
+"""
+Latency of the diary search on a seeded corpus: the full text search of queries.search_diary versus a naive ILIKE
+over moments, for common, rare and phrase searches.
+
+    python -m benchmarks.diary_search --users 1000 --entries 1000 --repeat 50
+
+The corpus is users x entries diary entries of random words, one million with the defaults. Seeding it with COPY
+takes a minute or two and it is removed again when done.
+"""
+import asyncio
+import datetime
+import io
+import json
+import random
+
+from aiopg.sa import create_engine
+import click
+from sqlalchemy import and_, select
+
+from app.db import blocking_connection
+from app.diary_import import import_diary
+from app.main import pg_dsn
+from app.models import sa_diary_entries
+from app.queries import search_diary
+from app.settings import Settings
+
+from .utils import BENCH_USER_ID, report, timed
+
+WORDS = ['walk', 'park', 'kids', 'dinner', 'pancakes', 'story', 'school', 'soccer', 'grandma', 'beach', 'rain',
+         'birthday', 'cake', 'garden', 'bike', 'movie', 'homework', 'museum', 'picnic', 'laughed', 'cried', 'sang']
+# words left out of WORDS but sprinkled in rarely
+RARE_WORDS = ['volcano', 'hedgehog', 'accordion']
+
+
+def generate_jsonl(entries: int, rnd: random.Random) -> str:
+    today = datetime.date.today()
+    lines = []
+    for n in range(entries):
+        moments = []
+        for _ in range(rnd.randint(1, 4)):
+            words = [rnd.choice(WORDS) for _ in range(rnd.randint(5, 40))]
+            if rnd.random() < 0.002:
+                words.insert(rnd.randrange(len(words)), rnd.choice(RARE_WORDS))
+            moments.append(' '.join(words).capitalize() + '.')
+        lines.append(json.dumps({'date': (today - datetime.timedelta(days=n)).isoformat(),
+                                 'moments': '\n\n'.join(moments)}) + '\n')
+    return ''.join(lines)
+
+
+def user_ids(users: int):
+    return range(BENCH_USER_ID, BENCH_USER_ID - users, -1)
+
+
+def seed(users: int, entries: int):
+    rnd = random.Random(42)
+    conn = blocking_connection(Settings())
+    try:
+        for user_id in user_ids(users):
+            import_diary(conn, user_id, io.StringIO(generate_jsonl(entries, rnd)), 'jsonl')
+        with conn, conn.cursor() as cur:
+            cur.execute('ANALYZE diary_entries')
+    finally:
+        conn.close()
+
+
+def remove(users: int):
+    conn = blocking_connection(Settings())
+    try:
+        with conn, conn.cursor() as cur:
+            low, high = BENCH_USER_ID - users + 1, BENCH_USER_ID
+            cur.execute('DELETE FROM diary_entries WHERE user_id BETWEEN %s AND %s', (low, high))
+            cur.execute('DELETE FROM diary_rollups WHERE user_id BETWEEN %s AND %s', (low, high))
+    finally:
+        conn.close()
+
+
+def ilike_search(user_id, word, limit):
+    return select([sa_diary_entries.c.created_on, sa_diary_entries.c.highlights]).where(and_(
+        sa_diary_entries.c.user_id == user_id,
+        sa_diary_entries.c.moments.ilike('%{}%'.format(word)),
+    )).order_by(sa_diary_entries.c.created_on.desc()).limit(limit)
+
+
+async def fetch(conn, query):
+    result = await conn.execute(query)
+    return await result.fetchall()
+
+
+async def run(repeat):
+    engine = await create_engine(pg_dsn(Settings()))
+
+    async with engine.acquire() as conn:
+        cases = [
+            ('search common word', lambda: fetch(conn, search_diary(BENCH_USER_ID, 'dinner', 20))),
+            ('search common, page 5', lambda: fetch(conn, search_diary(BENCH_USER_ID, 'dinner', 20, 80))),
+            ('search rare word', lambda: fetch(conn, search_diary(BENCH_USER_ID, 'hedgehog', 20))),
+            ('search phrase', lambda: fetch(conn, search_diary(BENCH_USER_ID, '"birthday cake"', 20))),
+            ('search no match', lambda: fetch(conn, search_diary(BENCH_USER_ID, 'submarine', 20))),
+            ('ilike common word', lambda: fetch(conn, ilike_search(BENCH_USER_ID, 'dinner', 20))),
+            ('ilike rare word', lambda: fetch(conn, ilike_search(BENCH_USER_ID, 'hedgehog', 20))),
+        ]
+        for name, fn in cases:
+            report(name, await timed(fn, repeat))
+
+    engine.close()
+    await engine.wait_closed()
+
+
+@click.command()
+@click.option('--users', default=1000, help='Number of diaries to seed')
+@click.option('--entries', default=1000, help='Entries per diary')
+@click.option('--repeat', default=50, help='Number of runs per search')
+def main(users, entries, repeat):
+    seed(users, entries)
+    print('seeded {} diary entries'.format(users * entries))
+    try:
+        asyncio.get_event_loop().run_until_complete(run(repeat))
+    finally:
+        remove(users)
+
+
+if __name__ == '__main__':
+    main()
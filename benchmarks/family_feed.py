@@ -0,0 +1,132 @@
+"""
+Cost of the family feed for growing families: saving an entry, which fans its highlights out to every guest unless
+the owner pulls, and reading a page of a guest's feed, with the owners' entries pushed into family_feed or pulled
+from diary_entries.
+
+    python -m benchmarks.family_feed --sizes 2,5,10,25,50 --days 365 --repeat 50
+
+Every member of a family invites all the others and writes an entry each day. Seeded users, invites and entries are
+removed again when done.
+"""
+import asyncio
+import datetime
+
+from aiopg.sa import create_engine
+import click
+
+from app.family import fan_out
+from app.main import pg_dsn
+from app.models import GuestRelation, InviteStatus, sa_diary_entries, sa_diary_invites, sa_family_feed, sa_users
+from app.queries import family_feed
+from app.settings import Settings
+
+from .utils import BENCH_USER_ID, BATCH_SIZE, report, sync_engine, timed
+
+PAGE_SIZE = Settings.FAMILY_FEED_PAGE_SIZE
+
+
+def member_ids(size: int):
+    return list(range(BENCH_USER_ID, BENCH_USER_ID - size, -1))
+
+
+def seed(size: int, days: int, pull: bool):
+    remove(size)
+    members = member_ids(size)
+    today = datetime.date.today()
+    dates = [today - datetime.timedelta(days=n) for n in range(days)]
+
+    engine = sync_engine()
+    with engine.begin() as conn:
+        conn.execute(sa_users.insert(), [{
+            'id': user_id,
+            'email': 'family{}@example.com'.format(-user_id),
+            'name': 'Member {}'.format(-user_id),
+            'family_feed_pull': pull,
+        } for user_id in members])
+        conn.execute(sa_diary_invites.insert(), [{
+            'user_id': owner_id,
+            'guest_id': guest_id,
+            'guest_name': 'Member {}'.format(-guest_id),
+            'guest_relation': GuestRelation.Other,
+            'status': InviteStatus.Accepted,
+        } for owner_id in members for guest_id in members if guest_id != owner_id])
+
+        entries = [{
+            'user_id': user_id,
+            'created_on': date,
+            'highlights': 'Went for a walk.',
+            'moments': 'Went for a walk. Then made dinner.',
+        } for user_id in members for date in dates]
+        for i in range(0, len(entries), BATCH_SIZE):
+            conn.execute(sa_diary_entries.insert(), entries[i:i + BATCH_SIZE])
+
+        if not pull:
+            feed = [dict(guest_id=guest_id, owner_id=entry['user_id'], created_on=entry['created_on'],
+                         highlights=entry['highlights'])
+                    for entry in entries for guest_id in members if guest_id != entry['user_id']]
+            for i in range(0, len(feed), BATCH_SIZE):
+                conn.execute(sa_family_feed.insert(), feed[i:i + BATCH_SIZE])
+
+        conn.execute('ANALYZE family_feed')
+        conn.execute('ANALYZE diary_entries')
+    engine.dispose()
+
+
+def remove(size: int):
+    members = member_ids(size)
+    engine = sync_engine()
+    with engine.begin() as conn:
+        conn.execute(sa_family_feed.delete().where(sa_family_feed.c.guest_id.in_(members)))
+        conn.execute(sa_diary_invites.delete().where(sa_diary_invites.c.user_id.in_(members)))
+        conn.execute(sa_diary_entries.delete().where(sa_diary_entries.c.user_id.in_(members)))
+        conn.execute(sa_users.delete().where(sa_users.c.id.in_(members)))
+    engine.dispose()
+
+
+async def save(conn, owner_id: int):
+    """ The family feed part of Day.post """
+    async with conn.begin():
+        result = await conn.execute(sa_users.update().where(sa_users.c.id == owner_id).values(
+            diary_version=sa_users.c.diary_version + 1,
+        ).returning(sa_users.c.family_feed_pull))
+        if not await result.scalar():
+            await fan_out(conn, owner_id, datetime.date.today(), 'Went for a walk.')
+
+
+async def read(conn, guest_id: int, before=None):
+    result = await conn.execute(family_feed(guest_id, before, PAGE_SIZE + 1))
+    return await result.fetchall()
+
+
+async def run(size: int, days: int, mode: str, repeat: int):
+    engine = await create_engine(pg_dsn(Settings()))
+    owner_id, guest_id = member_ids(size)[:2]
+    before = (datetime.date.today() - datetime.timedelta(days=days // 2), owner_id)
+
+    async with engine.acquire() as conn:
+        report('{:>2} members {} save'.format(size, mode), await timed(lambda: save(conn, owner_id), repeat))
+        report('{:>2} members {} read'.format(size, mode), await timed(lambda: read(conn, guest_id), repeat))
+        report('{:>2} members {} read older'.format(size, mode),
+               await timed(lambda: read(conn, guest_id, before), repeat))
+
+    engine.close()
+    await engine.wait_closed()
+
+
+@click.command()
+@click.option('--sizes', default='2,5,10,25,50', help='Comma separated family sizes')
+@click.option('--days', default=365, help='Days of entries written by every member')
+@click.option('--repeat', default=50, help='Number of runs per case')
+def main(sizes, days, repeat):
+    loop = asyncio.get_event_loop()
+    for size in [int(size) for size in sizes.split(',')]:
+        for mode in ('push', 'pull'):
+            seed(size, days, mode == 'pull')
+            try:
+                loop.run_until_complete(run(size, days, mode, repeat))
+            finally:
+                remove(size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Microbenchmark of highlight extraction: the original per moment regex scans that lived in Day.post versus
+app.highlights for single entries and in batches. This one does not need a database.
+
+    python -m benchmarks.highlights --entries 100000
+"""
+import random
+import re
+import time
+
+import click
+
+from app.highlights import highlight, highlight_many
+
+DOUBLE_NEWLINE_RE = re.compile('(?:\r?\n){2}')
+ENDING_CHARS_RE = re.compile('[!.]')
+TRAIL_CHARS_RE = re.compile('[:-]')
+
+WORDS = ['went', 'for', 'a', 'walk', 'with', 'the', 'kids', 'and', 'made', 'dinner', 'then', 'read', 'story']
+
+
+def original_highlight(moments):
+    highlights = []
+    for moment in DOUBLE_NEWLINE_RE.split(moments):
+        m = ENDING_CHARS_RE.search(moment)
+        hl_index = m.start() if m else -1
+
+        m = TRAIL_CHARS_RE.search(moment)
+        trail_index = m.start() if m else -1
+        if trail_index > 0 and (hl_index < 0 or trail_index < hl_index):
+            hl_index = trail_index
+        else:
+            trail_index = 100
+
+        if hl_index < 0 or hl_index >= trail_index:
+            highlights.append(moment[:trail_index].strip() + ('...' if len(moment) > trail_index else ''))
+        else:
+            highlights.append(moment[:hl_index+1].strip())
+    return ' '.join(highlights)
+
+
+def generate_entries(count, rnd):
+    entries = []
+    for _ in range(count):
+        moments = []
+        for _ in range(rnd.randint(1, 6)):
+            sentence = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 60)))
+            moments.append(sentence.capitalize() + rnd.choice(['.', '!', ': more', ' - more', '']))
+        entries.append('\n\n'.join(moments))
+    return entries
+
+
+def report(name, elapsed, count, total_bytes):
+    print('{:<12} {:8.1f}ms  {:10.0f} entries/s  {:8.1f} MB/s'.format(
+        name, elapsed * 1000, count / elapsed, total_bytes / elapsed / 1024 / 1024))
+
+
+@click.command()
+@click.option('--entries', default=100000, help='Number of generated diary entries')
+@click.option('--seed', default=42, help='Random seed for the generated entries')
+def main(entries, seed):
+    texts = generate_entries(entries, random.Random(seed))
+    total_bytes = sum(len(text) for text in texts)
+
+    start = time.perf_counter()
+    expected = [original_highlight(text) for text in texts]
+    report('original', time.perf_counter() - start, entries, total_bytes)
+
+    start = time.perf_counter()
+    single = [highlight(text) for text in texts]
+    report('single', time.perf_counter() - start, entries, total_bytes)
+
+    start = time.perf_counter()
+    batch = highlight_many(texts)
+    report('batch', time.perf_counter() - start, entries, total_bytes)
+
+    assert single == batch == expected
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Compare event loop stalls during a burst of concurrent logins when pbkdf2 runs inline on the loop versus in the
+PasswordHasher thread and process pools. This one does not need a database.
+
+    python -m benchmarks.login_hashing --logins 50 --workers 4
+"""
+import asyncio
+import time
+
+import click
+from passlib.hash import pbkdf2_sha256
+
+from app.passwords import PasswordHasher
+
+PASSWORD = 'correct horse battery staple'
+
+
+async def heartbeat(stop, interval=0.005):
+    """ :return: worst delay seen between ticks that should happen every interval, i.e. how long the loop stalled """
+    worst = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def inline_verify(password, password_hash):
+    return pbkdf2_sha256.verify(password, password_hash)
+
+
+async def burst(loop, verify, logins, password_hash):
+    stop = asyncio.Event()
+    ticker = loop.create_task(heartbeat(stop))
+    await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[verify(PASSWORD, password_hash) for _ in range(logins)])
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    return elapsed, await ticker
+
+
+def report(name, elapsed, stall):
+    print('{:<10} total {:8.1f}ms  worst loop stall {:8.1f}ms'.format(name, elapsed * 1000, stall * 1000))
+
+
+@click.command()
+@click.option('--logins', default=50, help='Number of concurrent logins')
+@click.option('--workers', default=4, help='Threads or processes in the hashing pool')
+def main(logins, workers):
+    loop = asyncio.get_event_loop()
+    password_hash = pbkdf2_sha256.hash(PASSWORD)
+
+    report('inline', *loop.run_until_complete(burst(loop, inline_verify, logins, password_hash)))
+    for name, use_processes in [('threads', False), ('processes', True)]:
+        hasher = PasswordHasher(loop, workers=workers, max_pending=logins, use_processes=use_processes)
+        report(name, *loop.run_until_complete(burst(loop, hasher.verify, logins, password_hash)))
+        hasher.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Bytes sent by Postgres and time taken for the month, day and index view queries when selecting whole rows versus
+only the columns the views render, for a user with long diary entries and a long life story.
+
+    python -m benchmarks.projection --moments-length 5000 --repeat 100
+
+Bytes are those of the DataRow messages of Postgres' text protocol, counted from the rows received.
+"""
+import asyncio
+import datetime
+
+from aiopg.sa import create_engine
+import click
+from sqlalchemy import and_
+
+from app.main import pg_dsn
+from app.models import sa_diary_entries, sa_users
+from app.queries import diary_entries, diary_entry, user_name
+from app.settings import Settings
+
+from .utils import BENCH_USER_ID, remove_diary, report, seed_diary, sync_engine, timed
+
+
+def long_moments(length: int) -> str:
+    moment = 'Went for a long walk with the kids and told them about the old days. '
+    return '\n\n'.join([moment * (length // len(moment) // 5 + 1)] * 5)[:length]
+
+
+def seed_user(life_story: str):
+    engine = sync_engine()
+    with engine.begin() as conn:
+        conn.execute(sa_users.delete().where(sa_users.c.id == BENCH_USER_ID))
+        conn.execute(sa_users.insert().values(
+            id=BENCH_USER_ID,
+            email='benchmark@example.com',
+            name='Benchmark',
+            life_title='Benchmarks all the way down',
+            life_story=life_story,
+            created_on=datetime.datetime.utcnow(),
+        ))
+    engine.dispose()
+
+
+def remove_user():
+    engine = sync_engine()
+    with engine.begin() as conn:
+        conn.execute(sa_users.delete().where(sa_users.c.id == BENCH_USER_ID))
+    engine.dispose()
+
+
+def data_row_bytes(rows) -> int:
+    """ Size of the DataRow messages: type, length and column count, then length and text of every value """
+    return sum(7 + sum(4 + (len(str(value).encode()) if value is not None else 0) for value in row) for row in rows)
+
+
+async def fetch(conn, query):
+    result = await conn.execute(query)
+    return await result.fetchall()
+
+
+async def run(repeat):
+    start_date = datetime.date.today().replace(day=1) - datetime.timedelta(days=1)
+    start_date, end_date = start_date.replace(day=1), start_date + datetime.timedelta(days=1)
+    engine = await create_engine(pg_dsn(Settings()))
+
+    cases = [
+        ('month: whole rows', sa_diary_entries.select(and_(
+            sa_diary_entries.c.user_id == BENCH_USER_ID,
+            sa_diary_entries.c.created_on >= start_date,
+            sa_diary_entries.c.created_on < end_date,
+        )).order_by(sa_diary_entries.c.created_on)),
+        ('month: projected', diary_entries(BENCH_USER_ID, start_date, end_date)),
+        ('day: whole row', sa_diary_entries.select(and_(
+            sa_diary_entries.c.user_id == BENCH_USER_ID,
+            sa_diary_entries.c.created_on == start_date,
+        ))),
+        ('day: projected', diary_entry(BENCH_USER_ID, start_date)),
+        ('index: whole row', sa_users.select(sa_users.c.id == BENCH_USER_ID)),
+        ('index: projected', user_name(BENCH_USER_ID)),
+    ]
+
+    async with engine.acquire() as conn:
+        for name, query in cases:
+            print('{:<30} {:10d} bytes'.format(name, data_row_bytes(await fetch(conn, query))))
+        for name, query in cases:
+            report(name, await timed(lambda: fetch(conn, query), repeat))
+
+    engine.close()
+    await engine.wait_closed()
+
+
+@click.command()
+@click.option('--moments-length', default=5000, help='Characters of moments per diary entry and of the life story')
+@click.option('--years', default=1, help='Years of daily entries to seed')
+@click.option('--repeat', default=100, help='Number of runs per query')
+def main(moments_length, years, repeat):
+    moments = long_moments(moments_length)
+    print('seeded {} diary entries'.format(seed_diary(years, moments)))
+    seed_user(moments)
+    try:
+        asyncio.get_event_loop().run_until_complete(run(repeat))
+    finally:
+        remove_diary()
+        remove_user()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Microbenchmark of the per request cost of hot path statements: building and compiling them with SQLAlchemy as aiopg
+does on every execute, versus binding parameters to app.statements compiled once. This one does not need a
+database.
+
+    python -m benchmarks.statements --calls 10000
+"""
+import datetime
+import time
+
+import click
+from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2
+
+from app import queries, statements
+
+TODAY = datetime.date.today()
+NOW = datetime.datetime.utcnow()
+
+CASES = [
+    ('diary_version',
+     lambda: queries.diary_version(1),
+     lambda: statements.diary_version.params(user_id=1)),
+    ('diary_entry',
+     lambda: queries.diary_entry(1, TODAY),
+     lambda: statements.diary_entry.params(user_id=1, date=TODAY)),
+    ('diary_entries',
+     lambda: queries.diary_entries(1, TODAY.replace(day=1), TODAY),
+     lambda: statements.diary_entries.params(user_id=1, start_date=TODAY.replace(day=1), end_date=TODAY)),
+    ('monthly_counts',
+     lambda: queries.monthly_counts(1, TODAY.year),
+     lambda: statements.monthly_counts.params(user_id=1, year=TODAY.year)),
+    ('session_user_id',
+     lambda: queries.session_user_id('abc', '127.0.0.1', NOW),
+     lambda: statements.session_user_id.params(session_id='abc', client_ip='127.0.0.1', created_after=NOW)),
+]
+
+
+def per_call(fn, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls
+
+
+@click.command()
+@click.option('--calls', default=10000, help='Number of calls per statement and approach')
+def main(calls):
+    dialect = PGDialect_psycopg2()
+    statements.compile_statements(dialect)
+
+    def build_and_compile(build):
+        # what aiopg's execute does with a ClauseElement
+        compiled = build().compile(dialect=dialect)
+        return str(compiled), compiled.construct_params()
+
+    for name, build, bind in CASES:
+        before = per_call(lambda: build_and_compile(build), calls)
+        after = per_call(bind, calls)
+        print('{:<16} compile {:8.1f}us  precompiled {:6.2f}us  {:6.0f}x'.format(
+            name, before * 1e6, after * 1e6, before / after))
+
+
+if __name__ == '__main__':
+    main()
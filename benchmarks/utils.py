@@ -0,0 +1,78 @@
+import datetime
+import statistics
+import time
+
+from sqlalchemy import create_engine
+
+from app.main import pg_dsn
+from app.management import rebuild_diary_rollups
+from app.models import sa_diary_entries, sa_diary_rollups
+from app.settings import Settings
+
+# user_id used for seeded data, it does not clash with real users as those come from a sequence starting at 1
+BENCH_USER_ID = -1
+BATCH_SIZE = 1000
+
+
+def sync_engine():
+    """ :return: a blocking sqlalchemy engine for seeding and cleaning up data """
+    return create_engine(pg_dsn(Settings()))
+
+
+def seed_diary(years: int, moments: str = 'Went for a walk. Then made dinner.', user_id: int = BENCH_USER_ID) -> int:
+    """
+    Write a diary entry for every day of the last given number of years.
+
+    :param years: number of years of entries to create
+    :param moments: moments text used for every entry
+    :param user_id: owner of the entries
+    :return: number of entries created
+    """
+    remove_diary(user_id)
+    today = datetime.date.today()
+    days = [today - datetime.timedelta(days=n) for n in range(365 * years)]
+
+    engine = sync_engine()
+    with engine.begin() as conn:
+        for i in range(0, len(days), BATCH_SIZE):
+            conn.execute(sa_diary_entries.insert(), [{
+                'user_id': user_id,
+                'created_on': day,
+                'highlights': moments[:100],
+                'moments': moments,
+            } for day in days[i:i + BATCH_SIZE]])
+    engine.dispose()
+
+    rebuild_diary_rollups(user_id)
+    return len(days)
+
+
+def remove_diary(user_id: int = BENCH_USER_ID):
+    """ Delete seeded diary entries and rollups """
+    engine = sync_engine()
+    with engine.begin() as conn:
+        conn.execute(sa_diary_entries.delete().where(sa_diary_entries.c.user_id == user_id))
+        conn.execute(sa_diary_rollups.delete().where(sa_diary_rollups.c.user_id == user_id))
+    engine.dispose()
+
+
+async def timed(fn, repeat: int) -> list:
+    """
+    :param fn: coroutine function to time
+    :param repeat: number of times to run it
+    :return: list of durations in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings: list):
+    """ Print median and 95th percentile of timings in milliseconds """
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print('{:<30} median {:8.3f}ms  p95 {:8.3f}ms  ({} runs)'.format(
+        name, statistics.median(ordered) * 1000, p95 * 1000, len(ordered)))
@@ -4,7 +4,10 @@ import os
 
 import click
 
-from app.management import prepare_database
+from app.db import blocking_connection
+from app.diary_import import FORMATS, UPLOAD_ERRORS, import_diary
+from app.management import prepare_database, rebuild_diary_rollups, rehighlight as rehighlight_entries
+from app.settings import Settings
 
 
 @click.group()
@@ -27,5 +30,39 @@ def initdb():
     prepare_database(delete_existing=True)
 
 
+@main.command('rebuild-rollups', help='Recount diary rollups from diary entries')
+@click.option('--user-id', type=int, help='Only rebuild rollups for this user')
+def rebuild_rollups(user_id):
+    rebuild_diary_rollups(user_id)
+
+
+@main.command(help='Recompute highlights of all diary entries')
+@click.option('--workers', default=4, help='Number of worker processes')
+@click.option('--batch-size', default=1000, help='Entries fetched and updated at a time')
+@click.option('--chunks', default=64, help='Number of user_id ranges to split the work into')
+@click.option('--checkpoint', default='.rehighlight.json', type=click.Path(), help='Progress file used to resume')
+@click.option('--restart', is_flag=True, help='Ignore an existing checkpoint and start over')
+def rehighlight(workers, batch_size, chunks, checkpoint, restart):
+    rehighlight_entries(workers, batch_size, chunks, checkpoint, restart)
+
+
+@main.command('import', help='Import diary entries from a JSON Lines or CSV file, as written by /diary/export')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user-id', type=int, required=True, help='Owner of the imported entries')
+@click.option('--format', 'import_format', type=click.Choice(FORMATS), help='Defaults to the file extension')
+def import_(path, user_id, import_format):
+    import_format = import_format or path.rpartition('.')[2]
+    settings = Settings()
+    conn = blocking_connection(settings)
+    try:
+        with open(path, encoding='utf-8', newline='') as f:
+            source = import_diary(conn, user_id, f, import_format, live_updates=settings.LIVE_UPDATES)
+    except UPLOAD_ERRORS as e:
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+    print('imported {} entries'.format(source.rows))
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,29 @@
+"""Unique diary entry per user and day
+
+Revision ID: 5b1f0d7c2a91
+Revises: 3632e1c5e000
+Create Date: 2026-10-18 09:12:41.318204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1f0d7c2a91'
+down_revision = '3632e1c5e000'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Concurrent saves could previously insert the same day twice, keep the latest entry only.
+    op.execute("""
+        DELETE FROM diary_entries a
+        USING diary_entries b
+        WHERE a.user_id = b.user_id AND a.created_on = b.created_on AND a.id < b.id
+    """)
+    op.create_unique_constraint('uq_diary_entries_user_id_created_on', 'diary_entries', ['user_id', 'created_on'])
+
+
+def downgrade():
+    op.drop_constraint('uq_diary_entries_user_id_created_on', 'diary_entries', type_='unique')
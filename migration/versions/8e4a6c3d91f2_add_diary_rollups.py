@@ -0,0 +1,36 @@
+"""Add diary rollups
+
+Revision ID: 8e4a6c3d91f2
+Revises: 5b1f0d7c2a91
+Create Date: 2026-10-18 10:02:17.514233
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4a6c3d91f2'
+down_revision = '5b1f0d7c2a91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('diary_rollups',
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('year', sa.Integer(), nullable=False),
+                    sa.Column('month', sa.Integer(), nullable=False),
+                    sa.Column('entries', sa.Integer(), nullable=False),
+                    sa.PrimaryKeyConstraint('user_id', 'year', 'month')
+                    )
+    op.execute("""
+        INSERT INTO diary_rollups (user_id, year, month, entries)
+        SELECT user_id, extract(year FROM created_on), extract(month FROM created_on), count(*)
+        FROM diary_entries
+        GROUP BY 1, 2, 3
+    """)
+
+
+def downgrade():
+    op.drop_table('diary_rollups')
@@ -0,0 +1,23 @@
+"""Index user sessions created on
+
+Revision ID: a4c1e97b3d25
+Revises: f3a8d52c61b7
+Create Date: 2026-10-18 17:21:44.093518
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c1e97b3d25'
+down_revision = 'f3a8d52c61b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_user_sessions_created_on'), 'user_sessions', ['created_on'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_user_sessions_created_on'), table_name='user_sessions')
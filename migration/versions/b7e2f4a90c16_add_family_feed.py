@@ -0,0 +1,32 @@
+"""Add family feed
+
+Revision ID: b7e2f4a90c16
+Revises: a4c1e97b3d25
+Create Date: 2026-10-18 19:05:12.664120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2f4a90c16'
+down_revision = 'a4c1e97b3d25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('family_feed',
+                    sa.Column('guest_id', sa.Integer(), nullable=False),
+                    sa.Column('created_on', sa.Date(), nullable=False),
+                    sa.Column('owner_id', sa.Integer(), nullable=False),
+                    sa.Column('highlights', sa.Text(), nullable=False),
+                    sa.PrimaryKeyConstraint('guest_id', 'created_on', 'owner_id')
+                    )
+    op.add_column('users', sa.Column('family_feed_pull', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'family_feed_pull')
+    op.drop_table('family_feed')
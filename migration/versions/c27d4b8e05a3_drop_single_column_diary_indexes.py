@@ -0,0 +1,27 @@
+"""Drop single column diary entry indexes
+
+Revision ID: c27d4b8e05a3
+Revises: 8e4a6c3d91f2
+Create Date: 2026-10-18 11:26:03.902771
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c27d4b8e05a3'
+down_revision = '8e4a6c3d91f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # uq_diary_entries_user_id_created_on is the composite index for every diary query, these only tempt the
+    # planner into BitmapAnd plans and slow down writes.
+    op.drop_index(op.f('ix_diary_entries_user_id'), table_name='diary_entries')
+    op.drop_index(op.f('ix_diary_entries_created_on'), table_name='diary_entries')
+
+
+def downgrade():
+    op.create_index(op.f('ix_diary_entries_created_on'), 'diary_entries', ['created_on'], unique=False)
+    op.create_index(op.f('ix_diary_entries_user_id'), 'diary_entries', ['user_id'], unique=False)
@@ -0,0 +1,26 @@
+"""Add user diary version
+
+Revision ID: e6b93a4f17d8
+Revises: c27d4b8e05a3
+Create Date: 2026-10-18 13:47:52.106391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b93a4f17d8'
+down_revision = 'c27d4b8e05a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('diary_version', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('diary_modified_on', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('users', 'diary_modified_on')
+    op.drop_column('users', 'diary_version')
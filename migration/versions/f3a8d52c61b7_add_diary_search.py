@@ -0,0 +1,29 @@
+"""Add diary full text search
+
+Revision ID: f3a8d52c61b7
+Revises: e6b93a4f17d8
+Create Date: 2026-10-18 16:02:37.418225
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a8d52c61b7'
+down_revision = 'e6b93a4f17d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # generated columns need Postgres 12, adding a stored one rewrites diary_entries
+    op.execute("ALTER TABLE diary_entries ADD COLUMN moments_tsv tsvector "
+               "GENERATED ALWAYS AS (to_tsvector('english', moments)) STORED")
+    # btree_gin lets user_id into the GIN index, a search then only matches entries of one diary within the index
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gin')
+    op.execute('CREATE INDEX ix_diary_entries_search ON diary_entries USING gin (user_id, moments_tsv)')
+
+
+def downgrade():
+    op.drop_index('ix_diary_entries_search', table_name='diary_entries')
+    op.drop_column('diary_entries', 'moments_tsv')
@@ -0,0 +1,15 @@
+import pytest
+
+
+class FakeTimer:
+    """ Stands in for time.monotonic, tests move time on by setting now """
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def timer():
+    return FakeTimer()
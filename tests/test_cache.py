@@ -0,0 +1,36 @@
+from app.cache import TTLCache
+
+
+def test_ttl_cache_expires_entries(timer):
+    cache = TTLCache(maxsize=10, ttl=5, timer=timer)
+    cache.set('session', 1)
+
+    assert cache.get('session') == 1
+    timer.now = 5
+    assert cache.get('session') is None
+    assert cache.stats() == {'size': 0, 'maxsize': 10, 'hits': 1, 'misses': 1}
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.pop('c') == 3
+    assert len(cache) == 1
+
+
+def test_ttl_cache_expire_removes_expired_entries(timer):
+    cache = TTLCache(maxsize=10, ttl=5, timer=timer)
+    cache.set('a', 1)
+    timer.now = 3
+    cache.set('b', 2)
+    timer.now = 5
+
+    assert cache.expire() == 1
+    assert len(cache) == 1
+    assert cache.get('b') == 2
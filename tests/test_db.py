@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+pytest.importorskip('psycopg2')
+
+from app.db import connection, release_connection, request_connection_middleware  # noqa: E402
+
+
+class FakeEngine:
+    """ Hands out numbered connections, counting acquires and releases """
+    def __init__(self):
+        self.acquired = []
+        self.released = []
+
+    async def acquire(self):
+        self.acquired.append(len(self.acquired) + 1)
+        return self.acquired[-1]
+
+    async def release(self, conn):
+        self.released.append(conn)
+
+
+def handle(handler, engine):
+    """ Handle a request with handler within request_connection_middleware """
+    loop = asyncio.new_event_loop()
+    middleware = loop.run_until_complete(request_connection_middleware({'pg_engine': engine}, handler))
+    try:
+        loop.run_until_complete(middleware({}))
+    finally:
+        loop.close()
+
+
+def test_connections_are_shared_within_a_request():
+    async def handler(request):
+        async with connection(request) as first:
+            pass
+        async with connection(request) as second:
+            assert second is first
+        return 'response'
+
+    engine = FakeEngine()
+    handle(handler, engine)
+    assert engine.acquired == [1]
+    assert engine.released == [1]
+
+
+def test_unused_connections_are_not_acquired():
+    async def handler(request):
+        return 'response'
+
+    engine = FakeEngine()
+    handle(handler, engine)
+    assert engine.acquired == []
+
+
+def test_connections_are_released_on_exceptions():
+    async def handler(request):
+        async with connection(request):
+            raise ValueError('broken view')
+
+    engine = FakeEngine()
+    with pytest.raises(ValueError):
+        handle(handler, engine)
+    assert engine.acquired == [1]
+    assert engine.released == [1]
+
+
+def test_streamed_responses_release_between_batches():
+    async def handler(request):
+        # like Export: a connection per batch, released while the batch is written
+        for _ in range(3):
+            async with connection(request):
+                pass
+            await release_connection(request)
+        async with connection(request):
+            return 'response'
+
+    engine = FakeEngine()
+    handle(handler, engine)
+    assert engine.acquired == [1, 2, 3, 4]
+    assert engine.released == [1, 2, 3, 4]
@@ -0,0 +1,165 @@
+import datetime
+import json
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+
+from app.db import blocking_connection  # noqa: E402
+from app.diary_import import CopySource, DiaryImportError, import_diary, parse_csv, parse_jsonl  # noqa: E402
+from app.live import CHANNEL  # noqa: E402
+from app.settings import Settings  # noqa: E402
+
+
+def read_all(source, size=7):
+    data = ''
+    chunk = source.read(size)
+    while chunk:
+        data += chunk
+        chunk = source.read(size)
+    return data
+
+
+def test_parse_jsonl():
+    lines = ['{"date": "2017-03-01", "highlights": "ignored", "moments": "Walk."}\n', '\n',
+             '{"date": "2017-03-02", "moments": "Dinner."}\n']
+    assert list(parse_jsonl(lines)) == [(datetime.date(2017, 3, 1), 'Walk.'), (datetime.date(2017, 3, 2), 'Dinner.')]
+
+
+def test_parse_jsonl_invalid():
+    with pytest.raises(DiaryImportError, match='Line 2'):
+        list(parse_jsonl(['{"date": "2017-03-01", "moments": "Walk."}\n', '{"date": "yesterday"}\n']))
+
+
+@pytest.mark.parametrize('moments', ['null', '42', '{"text": "Walk."}', '["Walk."]'])
+def test_parse_jsonl_moments_not_text(moments):
+    with pytest.raises(DiaryImportError, match='Line 1'):
+        list(parse_jsonl(['{"date": "2017-03-01", "moments": %s}\n' % moments]))
+
+
+def test_parse_csv():
+    lines = ['date,highlights,moments\r\n', '2017-03-01,x,"Walk.\n', '\n', 'Dinner, late."\r\n']
+    assert list(parse_csv(lines)) == [(datetime.date(2017, 3, 1), 'Walk.\n\nDinner, late.')]
+
+    with pytest.raises(DiaryImportError):
+        list(parse_csv(['date,moments\n', '2017-13-01,Walk.\n']))
+
+
+def test_parse_csv_missing_moments():
+    with pytest.raises(DiaryImportError, match='Line 3'):
+        list(parse_csv(['date,moments\n', '2017-03-01,Walk.\n', '2017-03-02\n']))
+
+
+def test_copy_source():
+    entries = [(datetime.date(2017, month, 1), 'Tab\there.\n\nBack\\slash: yes') for month in range(1, 13)]
+    source = CopySource(entries, batch_size=5)
+
+    lines = read_all(source).splitlines()
+    assert len(lines) == 12
+    assert lines[0] == '2017-01-01\tTab\\there. Back\\\\slash...\tTab\\there.\\n\\nBack\\\\slash: yes'
+    assert source.rows == 12
+    assert source.read(7) == ''
+
+
+class FakeCursor:
+    """ Reads COPY data the way psycopg2 does, which turns any exception raised by read into a QueryCanceledError """
+    def __init__(self):
+        self.copied = ''
+
+    def execute(self, sql, params=None):
+        pass
+
+    def copy_expert(self, sql, source, size=8192):
+        try:
+            chunk = source.read(size)
+            while chunk:
+                self.copied += chunk
+                chunk = source.read(size)
+        except Exception:
+            raise psycopg2.extensions.QueryCanceledError('COPY from stdin failed: error in .read() call')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.cur = FakeCursor()
+
+    def cursor(self):
+        return self.cur
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+@pytest.mark.parametrize('import_format, lines, error', [
+    ('jsonl', ['{"date": "2017-03-01", "moments": "Walk."}\n', 'not json\n'], DiaryImportError),
+    ('csv', ['date,moments\n', '2017-03-01,Walk.\n', '2017-03-32,Dinner.\n'], DiaryImportError),
+])
+def test_import_diary_raises_upload_errors_from_copy(import_format, lines, error):
+    conn = FakeConnection()
+    with pytest.raises(error):
+        import_diary(conn, 1, lines, import_format, batch_size=1)
+    assert conn.cur.copied.startswith('2017-03-01\t')
+
+
+def test_import_diary_keeps_database_errors():
+    class FailingCursor(FakeCursor):
+        def copy_expert(self, sql, source, size=8192):
+            raise psycopg2.extensions.QueryCanceledError('canceling statement due to statement timeout')
+
+    conn = FakeConnection()
+    conn.cur = FailingCursor()
+    with pytest.raises(psycopg2.extensions.QueryCanceledError):
+        import_diary(conn, 1, ['{"date": "2017-03-01", "moments": "Walk."}\n'], 'jsonl')
+
+
+@pytest.fixture
+def db():
+    try:
+        conn = blocking_connection(Settings())
+    except psycopg2.OperationalError as e:
+        pytest.skip('database is not available: {}'.format(e))
+
+    # import_diary commits, the owner -60 and their guest -61 are removed again when done
+    with conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO users (id, email, name) "
+                    "VALUES (-60, 'import60@example.com', 'Owner'), (-61, 'import61@example.com', 'Guest')")
+        cur.execute("INSERT INTO diary_invites (id, user_id, guest_id, guest_name, guest_relation, status) "
+                    "VALUES (nextval('diary_invite_id_seq'), -60, -61, 'Guest', 'Other', 'Accepted')")
+
+    yield conn
+
+    with conn, conn.cursor() as cur:
+        for table, column in [('family_feed', 'owner_id'), ('diary_invites', 'user_id'), ('diary_rollups', 'user_id'),
+                              ('diary_entries', 'user_id'), ('users', 'id')]:
+            cur.execute('DELETE FROM {} WHERE {} IN (-60, -61)'.format(table, column))
+    conn.close()
+
+
+def test_imported_entries_reach_the_family(db):
+    listener = blocking_connection(Settings())
+    listener.autocommit = True
+    listener.cursor().execute('LISTEN {}'.format(CHANNEL))
+
+    lines = ['{{"date": "2017-03-{:02}", "moments": "Walk {}."}}\n'.format(day, day) for day in range(1, 13)]
+    import_diary(db, -60, lines, 'jsonl', live_updates=True)
+
+    with db, db.cursor() as cur:
+        cur.execute('SELECT created_on, highlights FROM family_feed WHERE guest_id = -61 ORDER BY created_on')
+        feed = cur.fetchall()
+    assert len(feed) == 12
+    assert feed[0] == (datetime.date(2017, 3, 1), 'Walk 1.')
+
+    listener.poll()
+    dates = [json.loads(notification.payload)['date'] for notification in listener.notifies]
+    listener.close()
+    # only the newest entries go out live, oldest first
+    assert dates == ['2017-03-{:02}'.format(day) for day in range(3, 13)]
@@ -0,0 +1,102 @@
+import asyncio
+import datetime
+
+import pytest
+
+pytest.importorskip('aiohttp')
+pytest.importorskip('aiohttp_jinja2')
+pytest.importorskip('aiopg')
+
+from aiohttp.test_utils import make_mocked_request  # noqa: E402
+from aiohttp.web import HTTPNotModified  # noqa: E402
+
+from app import statements  # noqa: E402
+from app.views import diary  # noqa: E402
+
+MODIFIED_ON = datetime.datetime(2017, 6, 1, 12, 30, 15, 250000)
+TODAY = datetime.date.today().strftime('.%Y%m%d')
+
+
+class FakeVersion:
+    diary_version = 5
+    diary_modified_on = MODIFIED_ON
+
+
+class FakeResult:
+    async def first(self):
+        return FakeVersion()
+
+
+class FakeConnection:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+@pytest.fixture
+def not_modified(monkeypatch):
+    async def execute(conn, **params):
+        return FakeResult()
+
+    monkeypatch.setattr(diary, 'connection', lambda request: FakeConnection())
+    monkeypatch.setattr(statements.diary_version, 'execute', execute)
+
+    def not_modified(headers, daily=False):
+        request = make_mocked_request('GET', '/diary/2017/6', headers=headers)
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(diary.DiaryView(request).not_modified(1, daily)), request
+        finally:
+            loop.close()
+    return not_modified
+
+
+@pytest.mark.parametrize('if_none_match, current', [
+    ('W/"1.5"', True),
+    # weak comparison, clients may drop the W/ or send several tags
+    ('"1.5"', True),
+    ('"0.1", W/"1.5"', True),
+    ('*', True),
+    ('W/"1.4"', False),
+    ('W/"2.5"', False),
+])
+def test_etags(not_modified, if_none_match, current):
+    response, request = not_modified({'If-None-Match': if_none_match})
+
+    if current:
+        assert isinstance(response, HTTPNotModified)
+        assert response.headers['ETag'] == 'W/"1.5"'
+    else:
+        assert response is None
+        assert request['diary_etag'] == 'W/"1.5"'
+        assert request['diary_version'] == 5
+
+
+def test_daily_etags_change_with_the_date(not_modified):
+    response, request = not_modified({'If-None-Match': 'W/"1.5"'}, daily=True)
+    assert response is None
+    assert request['diary_etag'] == 'W/"1.5{}"'.format(TODAY)
+
+    response, _ = not_modified({'If-None-Match': 'W/"1.5{}"'.format(TODAY)}, daily=True)
+    assert isinstance(response, HTTPNotModified)
+
+
+@pytest.mark.parametrize('headers, daily, current', [
+    # Last-Modified only has whole seconds
+    ({'If-Modified-Since': 'Thu, 01 Jun 2017 12:30:15 GMT'}, False, True),
+    ({'If-Modified-Since': 'Thu, 01 Jun 2017 12:30:14 GMT'}, False, False),
+    ({'If-Modified-Since': 'Thu, 01 Jun 2017 12:30:15 GMT'}, True, False),
+    # If-None-Match takes precedence
+    ({'If-Modified-Since': 'Thu, 01 Jun 2017 12:30:15 GMT', 'If-None-Match': 'W/"1.4"'}, False, False),
+    ({}, False, False),
+])
+def test_if_modified_since(not_modified, headers, daily, current):
+    response, request = not_modified(headers, daily)
+
+    if current:
+        assert isinstance(response, HTTPNotModified)
+    else:
+        assert response is None
+        assert request['diary_modified_on'] == MODIFIED_ON
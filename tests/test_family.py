@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+sqlalchemy = pytest.importorskip('sqlalchemy')
+
+from sqlalchemy.dialects import postgresql  # noqa: E402
+
+from app.family import FamilyIndex, invite_status_update, update_feed  # noqa: E402
+from app.main import pg_dsn  # noqa: E402
+from app.models import GuestRelation, InviteStatus, sa_diary_invites  # noqa: E402
+from app.settings import Settings  # noqa: E402
+
+
+def test_family_index_answers_from_cache_until_invalidated():
+    loop = asyncio.new_event_loop()
+    index = FamilyIndex(maxsize=10, ttl=60)
+    index.owners.set(2, frozenset([1]))
+
+    # cached entries don't touch the request's connection
+    assert loop.run_until_complete(index.can_read(None, 2, 1))
+    assert not loop.run_until_complete(index.can_read(None, 2, 3))
+    assert loop.run_until_complete(index.can_read(None, 3, 3))
+    assert not loop.run_until_complete(index.can_read(None, None, 3))
+
+    index.invalidate(2)
+    assert 2 not in index.owners
+    loop.close()
+
+
+class FakeResult:
+    def __init__(self, value):
+        self.value = value
+
+    async def scalar(self):
+        return self.value
+
+
+class FakeConnection:
+    """ Records the kind of statements executed, answering them with the given scalars in turn """
+    def __init__(self, *scalars):
+        self.scalars = list(scalars)
+        self.statements = []
+
+    async def execute(self, statement):
+        self.statements.append(str(statement.compile(dialect=postgresql.dialect())).split()[0])
+        return FakeResult(self.scalars.pop(0) if self.scalars else None)
+
+
+@pytest.mark.parametrize('guests,switched,statements', [
+    # past the fan out limit: the owner switches to pull and their rows leave every guest's feed
+    (Settings.FAMILY_FEED_FANOUT_LIMIT + 1, True, ['SELECT', 'UPDATE', 'DELETE']),
+    # already pulling, nothing to write
+    (Settings.FAMILY_FEED_FANOUT_LIMIT + 1, False, ['SELECT', 'UPDATE']),
+    # back to fan out: every accepted guest gets the recent entries
+    (Settings.FAMILY_FEED_FANOUT_LIMIT, True, ['SELECT', 'UPDATE', 'INSERT']),
+    # fanning out already, only the new guest gets the recent entries
+    (1, False, ['SELECT', 'UPDATE', 'INSERT']),
+])
+def test_update_feed_on_accepted_invite(guests, switched, statements):
+    loop = asyncio.new_event_loop()
+    conn = FakeConnection(guests, 1 if switched else None)
+    loop.run_until_complete(update_feed(conn, Settings, 1, 2, InviteStatus.Accepted))
+    assert conn.statements == statements
+    loop.close()
+
+
+def test_update_feed_on_declined_invite_removes_guest_rows():
+    loop = asyncio.new_event_loop()
+    conn = FakeConnection(0, None)
+    loop.run_until_complete(update_feed(conn, Settings, 1, 2, InviteStatus.Declined))
+    assert conn.statements == ['SELECT', 'UPDATE', 'DELETE']
+    loop.close()
+
+
+@pytest.fixture
+def conn():
+    try:
+        engine = sqlalchemy.create_engine(pg_dsn(Settings()))
+        conn = engine.connect()
+    except (RuntimeError, sqlalchemy.exc.OperationalError) as e:
+        pytest.skip('database is not available: {}'.format(e))
+
+    trans = conn.begin()
+    yield conn
+    trans.rollback()
+    conn.close()
+    engine.dispose()
+
+
+def test_guests_cannot_undo_a_revoke(conn):
+    owner_id, guest_id = -1, -2
+    invite_id = conn.execute(sa_diary_invites.insert().values(
+        user_id=owner_id,
+        guest_id=guest_id,
+        guest_name='Guest',
+        guest_relation=GuestRelation.Child,
+        status=InviteStatus.Sent,
+    ).returning(sa_diary_invites.c.id)).scalar()
+
+    def change(user_id, status):
+        return conn.execute(invite_status_update(invite_id, user_id, status)).first()
+
+    assert change(guest_id, InviteStatus.Accepted) == (owner_id, guest_id)
+    assert change(owner_id, InviteStatus.Declined) == (owner_id, guest_id)
+    assert change(guest_id, InviteStatus.Accepted) is None
+    assert conn.execute(sa_diary_invites.select().where(
+        sa_diary_invites.c.id == invite_id)).first().status is InviteStatus.Declined
+
+    # nor can the owner accept on behalf of the guest
+    assert change(owner_id, InviteStatus.Accepted) is None
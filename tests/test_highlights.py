@@ -0,0 +1,40 @@
+import random
+import re
+
+from app.highlights import highlight, highlight_many
+
+
+def reference_highlight(moments):
+    """ The original per moment implementation from Day.post """
+    highlights = []
+    for moment in re.split('(?:\r?\n){2}', moments):
+        m = re.search('[!.]', moment)
+        hl_index = m.start() if m else -1
+
+        m = re.search('[:-]', moment)
+        trail_index = m.start() if m else -1
+        if trail_index > 0 and (hl_index < 0 or trail_index < hl_index):
+            hl_index = trail_index
+        else:
+            trail_index = 100
+
+        if hl_index < 0 or hl_index >= trail_index:
+            highlights.append(moment[:trail_index].strip() + ('...' if len(moment) > trail_index else ''))
+        else:
+            highlights.append(moment[:hl_index+1].strip())
+    return ' '.join(highlights)
+
+
+def test_highlight():
+    assert highlight('Went for a walk. Then made dinner.\n\nMorning: pancakes!') == 'Went for a walk. Morning...'
+    assert highlight('- started with a dash. done') == '- started with a dash.'
+    assert highlight('x' * 120) == 'x' * 100 + '...'
+
+
+def test_highlight_matches_original_implementation():
+    rnd = random.Random(42)
+    entries = []
+    for alphabet in ('ab .!:-\n\r' + ' ' * 5, 'a' * 60 + ' ' * 10 + '.!:-\n'):
+        entries.extend(''.join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 400))) for _ in range(1000))
+
+    assert highlight_many(entries) == [reference_highlight(moments) for moments in entries]
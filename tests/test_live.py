@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip('aiohttp')
+pytest.importorskip('sqlalchemy')
+
+from app.family import FamilyIndex  # noqa: E402
+from app.live import LiveHub  # noqa: E402
+
+
+class FakeWebSocket:
+    """ Records messages, drain blocks unless writable is set """
+    def __init__(self, stalled=False):
+        self.sent = []
+        self.close_code = None
+        self.writable = asyncio.Event()
+        if not stalled:
+            self.writable.set()
+
+    def send_str(self, message):
+        self.sent.append(json.loads(message))
+
+    async def drain(self):
+        await self.writable.wait()
+
+    async def close(self, code, message=b''):
+        self.close_code = code
+
+
+def entry(owner_id, date='2017-06-01'):
+    return json.dumps({'type': 'entry', 'owner_id': owner_id, 'date': date, 'highlights': 'Went for a walk.'})
+
+
+def invite(owner_id, guest_id, accepted):
+    return json.dumps({'type': 'invite', 'owner_id': owner_id, 'guest_id': guest_id, 'accepted': accepted})
+
+
+async def close(hub):
+    await hub.close()
+    # let the cancelled senders finish
+    await asyncio.sleep(0)
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+def test_entries_go_to_guests_of_the_owner(loop):
+    hub = LiveHub(queue_size=4, ping_interval=30, retry_interval=5)
+    guest, other = FakeWebSocket(), FakeWebSocket()
+    hub.subscribe(guest, 2, [1], loop)
+    hub.subscribe(other, 3, [4], loop)
+
+    hub.dispatch(entry(1))
+    loop.run_until_complete(asyncio.sleep(0))
+
+    assert guest.sent == [{'owner_id': 1, 'date': '2017-06-01', 'highlights': 'Went for a walk.'}]
+    assert other.sent == []
+    assert hub.stats() == {'subscribers': 2, 'notifications': 1, 'sent': 1, 'dropped': 0}
+    loop.run_until_complete(close(hub))
+
+
+def test_invites_change_subscriptions(loop):
+    family_index = FamilyIndex(maxsize=10, ttl=60)
+    family_index.owners.set(2, frozenset([1]))
+    hub = LiveHub(queue_size=4, ping_interval=30, retry_interval=5, family_index=family_index)
+    guest = FakeWebSocket()
+    hub.subscribe(guest, 2, [], loop)
+
+    hub.dispatch(invite(1, 2, True))
+    hub.dispatch(entry(1, '2017-06-01'))
+    hub.dispatch(invite(1, 2, False))
+    hub.dispatch(entry(1, '2017-06-02'))
+    loop.run_until_complete(asyncio.sleep(0))
+
+    assert [message['date'] for message in guest.sent] == ['2017-06-01']
+    assert 1 not in hub.by_owner
+    # invites changed in other workers reach this worker's family index too
+    assert 2 not in family_index.owners
+    loop.run_until_complete(close(hub))
+
+
+def test_slow_guests_are_dropped(loop):
+    hub = LiveHub(queue_size=2, ping_interval=30, retry_interval=5)
+    slow, fast = FakeWebSocket(stalled=True), FakeWebSocket()
+    hub.subscribe(slow, 2, [1], loop)
+    hub.subscribe(fast, 3, [1], loop)
+
+    # the first message is taken by the sender, which then waits for the stalled socket
+    for day in range(1, 6):
+        hub.dispatch(entry(1, '2017-06-0{}'.format(day)))
+        loop.run_until_complete(asyncio.sleep(0))
+
+    assert len(fast.sent) == 5
+    assert slow.close_code == 1013
+    assert hub.stats()['dropped'] == 1
+    assert hub.stats()['subscribers'] == 1
+    loop.run_until_complete(close(hub))
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+pytest.importorskip('aiohttp_jinja2')
+pytest.importorskip('aiopg')
+
+from aiohttp.test_utils import make_mocked_request  # noqa: E402
+from aiohttp.web import HTTPForbidden  # noqa: E402
+
+from app.main import create_app  # noqa: E402
+from app.views.diary import Export, Import, Timeline  # noqa: E402
+from app.views.metrics import metrics  # noqa: E402
+
+
+def test_create_app_sets_up_routes():
+    loop = asyncio.new_event_loop()
+    app = create_app(loop)
+
+    assert str(app.router['diary-upload'].url_for()) == '/diary/import'
+    assert str(app.router['family-live'].url_for()) == '/family/live'
+    assert str(app.router['family-diary-month'].url_for(owner_id='3', year='2017', month='1')) == '/family/3/diary/2017/1'
+    loop.close()
+
+
+@pytest.mark.parametrize('view, method', [(Timeline, 'GET'), (Export, 'GET'), (Import, 'POST')])
+def test_diary_apis_reject_anonymous_calls(view, method):
+    loop = asyncio.new_event_loop()
+    request = make_mocked_request(method, '/', app=create_app(loop))
+
+    # API clients get an error rather than a redirect to the login form
+    with pytest.raises(HTTPForbidden):
+        loop.run_until_complete(getattr(view(request), method.lower())())
+    loop.close()
+
+
+@pytest.mark.parametrize('token, authorization, allowed', [
+    ('', None, False),
+    ('', 'Bearer ', False),
+    ('secret', None, False),
+    ('secret', 'Bearer wrong', False),
+    ('secret', 'Bearer secret', True),
+])
+def test_metrics_need_the_token(token, authorization, allowed):
+    loop = asyncio.new_event_loop()
+    app = create_app(loop)
+    app['settings'].METRICS_TOKEN = token
+    headers = {'Authorization': authorization} if authorization else {}
+    request = make_mocked_request('GET', '/metrics', headers=headers, app=app)
+
+    if allowed:
+        response = loop.run_until_complete(metrics(request))
+        assert 'pof_requests_total' in response.text
+    else:
+        with pytest.raises(HTTPForbidden):
+            loop.run_until_complete(metrics(request))
+    loop.close()
@@ -0,0 +1,93 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+import json
+
+import pytest
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+pytest.importorskip('psycopg2')
+
+from app import management  # noqa: E402
+from app.highlights import highlight_many  # noqa: E402
+from app.main import pg_dsn  # noqa: E402
+from app.models import sa_diary_entries  # noqa: E402
+from app.settings import Settings  # noqa: E402
+
+USER_IDS = range(-40, -30)
+
+
+def test_rehighlight_resumes_from_the_checkpoint(tmpdir, monkeypatch):
+    checkpoint = str(tmpdir.join('rehighlight.json'))
+    with open(checkpoint, 'w') as f:
+        json.dump({'ranges': [[0, 10], [10, 20], [20, 30]], 'done': [[0, 10]]}, f)
+
+    ranges = []
+
+    def rehighlight_range(low, high, batch_size):
+        ranges.append([low, high])
+        if low == 20:
+            raise RuntimeError('worker died')
+        return 5, 1
+
+    # threads instead of processes, so that the patched rehighlight_range is the one run
+    monkeypatch.setattr(management, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(management, 'rehighlight_range', rehighlight_range)
+
+    with pytest.raises(RuntimeError):
+        management.rehighlight(workers=1, batch_size=100, chunks=3, checkpoint=checkpoint)
+    with open(checkpoint) as f:
+        done = json.load(f)['done']
+    assert [0, 10] in done and [20, 30] not in done
+    assert sorted(ranges) == [[10, 20], [20, 30]]
+
+    ranges.clear()
+    monkeypatch.setattr(management, 'rehighlight_range', lambda low, high, batch_size: ranges.append([low, high]) or (5, 1))
+    assert management.rehighlight(workers=1, batch_size=100, chunks=3, checkpoint=checkpoint) == 3 - len(done)
+    assert sorted(ranges + done) == [[0, 10], [10, 20], [20, 30]]
+    assert not tmpdir.join('rehighlight.json').exists()
+
+
+@pytest.fixture
+def engine():
+    try:
+        engine = sqlalchemy.create_engine(pg_dsn(Settings()))
+        engine.connect().close()
+    except (RuntimeError, sqlalchemy.exc.OperationalError) as e:
+        pytest.skip('database is not available: {}'.format(e))
+
+    # rehighlight_range reads and writes on connections of its own, the entries have to be committed
+    engine.execute(sa_diary_entries.insert(), [{
+        'user_id': user_id,
+        'created_on': datetime.date(2017, 1, day),
+        'highlights': 'stale',
+        'moments': 'Walked on day {}. Then made dinner.'.format(day),
+    } for user_id in USER_IDS for day in range(1, 4)])
+
+    yield engine
+
+    engine.execute(sa_diary_entries.delete().where(sa_diary_entries.c.user_id.in_(USER_IDS)))
+    engine.dispose()
+
+
+def test_rehighlight_range_skips_entries_saved_meanwhile(engine, monkeypatch):
+    edited = sa_diary_entries.c.user_id == USER_IDS[0]
+
+    def highlight_and_save(moments):
+        highlights = highlight_many(moments)
+        # Day.post saves an entry of the batch after it was read
+        engine.execute(sa_diary_entries.update().where(edited).values(highlights='Saved.', moments='Saved.'))
+        return highlights
+
+    monkeypatch.setattr(management, 'highlight_many', highlight_and_save)
+    seen, updated = management.rehighlight_range(USER_IDS[0], USER_IDS[-1] + 1, batch_size=4)
+
+    assert seen == 30
+    assert updated == 27
+    rows = engine.execute(select_entries()).fetchall()
+    assert {row.highlights for row in rows if row.user_id == USER_IDS[0]} == {'Saved.'}
+    assert all(row.highlights.startswith('Walked on day') for row in rows if row.user_id != USER_IDS[0])
+
+
+def select_entries():
+    return sqlalchemy.select([sa_diary_entries.c.user_id, sa_diary_entries.c.highlights]).where(
+        sa_diary_entries.c.user_id.in_(USER_IDS))
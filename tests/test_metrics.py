@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+pytest.importorskip('jinja2')
+
+from aiohttp.test_utils import make_mocked_request  # noqa: E402
+
+from app.metrics import Histogram, Metrics, metrics_middleware  # noqa: E402
+from app.settings import Settings  # noqa: E402
+
+
+def test_histogram_cumulative_counts():
+    histogram = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+
+    assert histogram.cumulative_counts() == [(0.1, 2), (1, 3), (float('inf'), 4)]
+    assert histogram.count == 4
+    assert histogram.sum == 3.65
+
+
+def test_websocket_sessions_are_not_request_latencies():
+    class Response:
+        status = 101
+
+    async def handler(request):
+        return Response()
+
+    loop = asyncio.new_event_loop()
+    metrics = Metrics()
+    middleware = loop.run_until_complete(metrics_middleware({'metrics': metrics, 'settings': Settings(DB_PASSWORD='x')},
+                                                            handler))
+    loop.run_until_complete(middleware(make_mocked_request('GET', '/family/live', headers={'Upgrade': 'websocket'})))
+    loop.run_until_complete(middleware(make_mocked_request('GET', '/diary')))
+    loop.close()
+
+    assert [histogram.count for histogram in metrics.websocket_time.values()] == [1]
+    assert [histogram.count for histogram in metrics.request_time.values()] == [1]
+    assert sum(metrics.requests.values()) == 2
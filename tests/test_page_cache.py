@@ -0,0 +1,37 @@
+import asyncio
+
+from app.page_cache import LocalPageCache, month_page_key, year_page_key
+
+
+def test_local_page_cache_evicts_beyond_max_bytes():
+    loop = asyncio.new_event_loop()
+    cache = LocalPageCache(max_bytes=10, ttl=60)
+
+    loop.run_until_complete(cache.set(month_page_key(1, 1, 2017, 1), b'12345'))
+    loop.run_until_complete(cache.set(month_page_key(1, 1, 2017, 2), b'12345'))
+    loop.run_until_complete(cache.get(month_page_key(1, 1, 2017, 1)))
+    loop.run_until_complete(cache.set(year_page_key(1, 1, 2017), b'123'))
+
+    assert loop.run_until_complete(cache.get(month_page_key(1, 1, 2017, 1))) == b'12345'
+    assert loop.run_until_complete(cache.get(month_page_key(1, 1, 2017, 2))) is None
+    assert cache.size == 8
+    loop.close()
+
+
+def test_local_page_cache_expiry(timer):
+    loop = asyncio.new_event_loop()
+    cache = LocalPageCache(max_bytes=100, ttl=5, timer=timer)
+
+    loop.run_until_complete(cache.set(month_page_key(1, 1, 2017, 1), b'month'))
+    loop.run_until_complete(cache.set(year_page_key(1, 1, 2017), b'year'))
+    assert loop.run_until_complete(cache.get(month_page_key(1, 1, 2017, 1))) == b'month'
+
+    timer.now = 5
+    assert loop.run_until_complete(cache.get(year_page_key(1, 1, 2017))) is None
+    assert cache.stats() == {'pages': 1, 'bytes': 5, 'hits': 1, 'misses': 1}
+    loop.close()
+
+
+def test_page_keys_change_with_the_diary_version():
+    assert month_page_key(1, 1, 2017, 1) != month_page_key(1, 2, 2017, 1)
+    assert year_page_key(1, 1, 2017) != year_page_key(1, 2, 2017)
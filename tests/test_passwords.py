@@ -0,0 +1,34 @@
+import asyncio
+
+from app.passwords import PasswordHasher, PasswordHasherBusy
+
+
+def test_password_hasher_round_trip():
+    loop = asyncio.new_event_loop()
+    hasher = PasswordHasher(loop, workers=1, max_pending=1)
+
+    password_hash = loop.run_until_complete(hasher.hash('secret'))
+
+    assert loop.run_until_complete(hasher.verify('secret', password_hash))
+    assert not loop.run_until_complete(hasher.verify('guess', password_hash))
+    assert hasher.pending == 0
+    hasher.close()
+    loop.close()
+
+
+def test_password_hasher_rejects_when_busy():
+    loop = asyncio.new_event_loop()
+    hasher = PasswordHasher(loop, workers=1, max_pending=1)
+
+    async def burst():
+        return await asyncio.gather(hasher.hash('one'), hasher.hash('two'), return_exceptions=True)
+
+    # gather doesn't start the calls in argument order on every Python version
+    results = loop.run_until_complete(burst())
+    busy = [result for result in results if isinstance(result, PasswordHasherBusy)]
+    hashed = [result for result in results if not isinstance(result, PasswordHasherBusy)]
+
+    assert len(busy) == 1
+    assert hashed[0].startswith('$pbkdf2-sha256$')
+    hasher.close()
+    loop.close()
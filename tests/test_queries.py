@@ -0,0 +1,39 @@
+"""
+Holds the query builders to the columns their callers use, so that e.g. the month view doesn't start fetching
+moments again.
+"""
+import datetime
+
+import pytest
+
+pytest.importorskip('sqlalchemy')
+
+from app import queries  # noqa: E402
+
+TODAY = datetime.date.today()
+NOW = datetime.datetime.utcnow()
+
+
+def column_names(query):
+    return [column.name for column in query.columns]
+
+
+@pytest.mark.parametrize('query,columns', [
+    (queries.diary_entry(1, TODAY), ['moments']),
+    (queries.diary_entries(1, TODAY.replace(day=1), TODAY), ['created_on', 'highlights']),
+    (queries.diary_entries_after(1, None, 500), ['created_on', 'highlights', 'moments']),
+    (queries.diary_entries_before(1, None, 50), ['created_on', 'highlights']),
+    (queries.diary_entries_before(1, None, 50, moments=True), ['created_on', 'highlights', 'moments']),
+    (queries.search_diary(1, 'dinner', 20), ['created_on', 'rank', 'snippet']),
+    (queries.family_feed(1, (TODAY, 2), 50), ['owner_id', 'owner_name', 'created_on', 'highlights']),
+    (queries.monthly_counts(1, TODAY.year), ['month', 'entries']),
+    (queries.monthly_counts(1, TODAY.year, use_rollups=False), ['month', 'entries']),
+    (queries.yearly_counts(1), ['year', 'entries']),
+    (queries.yearly_counts(1, use_rollups=False), ['year', 'entries']),
+    (queries.diary_version(1), ['diary_version', 'diary_modified_on']),
+    (queries.user_name(1), ['name']),
+    (queries.user_credentials('a@example.com'), ['id', 'password']),
+    (queries.session_user_id('abc', '127.0.0.1', NOW), ['user_id']),
+])
+def test_queries_select_only_used_columns(query, columns):
+    assert column_names(query) == columns
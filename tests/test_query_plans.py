@@ -0,0 +1,115 @@
+"""
+Checks that the diary view queries are served by indexes. These run EXPLAIN against the database configured by
+Settings (see `manage.py initdb`) and are skipped when it is not available.
+"""
+import datetime
+import json
+
+import pytest
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+pytest.importorskip('psycopg2')
+
+from app.main import pg_dsn  # noqa: E402
+from app.models import GuestRelation, InviteStatus, sa_diary_entries, sa_diary_invites, sa_users  # noqa: E402
+from app import queries  # noqa: E402
+from app.settings import Settings  # noqa: E402
+
+USER_IDS = range(-20, 0)
+# -1 is invited by everyone else, half of them have their entries pulled into the family feed
+GUEST_ID = -1
+TODAY = datetime.date.today()
+
+
+@pytest.fixture(scope='module')
+def conn():
+    try:
+        engine = sqlalchemy.create_engine(pg_dsn(Settings()))
+        conn = engine.connect()
+    except (RuntimeError, sqlalchemy.exc.OperationalError) as e:
+        pytest.skip('database is not available: {}'.format(e))
+
+    trans = conn.begin()
+    for user_id in USER_IDS:
+        conn.execute(sa_diary_entries.insert(), [{
+            'user_id': user_id,
+            'created_on': TODAY - datetime.timedelta(days=n),
+            'highlights': 'Walked.',
+            'moments': 'Walked. Then made dinner.',
+        } for n in range(365 * 2)])
+    conn.execute(sa_users.insert(), [{
+        'id': user_id,
+        'email': 'plan{}@example.com'.format(-user_id),
+        'name': 'Plan {}'.format(-user_id),
+        'family_feed_pull': user_id % 2 == 0,
+    } for user_id in USER_IDS])
+    conn.execute(sa_diary_invites.insert(), [{
+        'user_id': user_id,
+        'guest_id': GUEST_ID,
+        'guest_name': 'Plan 1',
+        'guest_relation': GuestRelation.Other,
+        'status': InviteStatus.Accepted,
+    } for user_id in USER_IDS if user_id != GUEST_ID])
+    conn.execute('ANALYZE diary_entries')
+    conn.execute('ANALYZE users')
+    conn.execute('ANALYZE diary_invites')
+    # only a missing index should make the planner fall back to a sequential scan
+    conn.execute('SET LOCAL enable_seqscan = off')
+
+    yield conn
+
+    trans.rollback()
+    conn.close()
+    engine.dispose()
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def explain(conn, query):
+    compiled = query.compile(dialect=conn.dialect)
+    params = {}
+    for key, value in compiled.params.items():
+        # e.g. enums are only turned into their names by their type
+        process = compiled.binds[key].type.bind_processor(conn.dialect)
+        params[key] = process(value) if process else value
+    cursor = conn.connection.cursor()
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + str(compiled), params)
+    plan = cursor.fetchone()[0]
+    return list(plan_nodes((plan if isinstance(plan, list) else json.loads(plan))[0]['Plan']))
+
+
+@pytest.mark.parametrize('query', [
+    queries.diary_entry(-1, TODAY),
+    queries.diary_entries(-1, TODAY.replace(day=1), TODAY + datetime.timedelta(days=1)),
+    queries.diary_entries_after(-1, TODAY - datetime.timedelta(days=100), 500),
+    queries.monthly_counts(-1, TODAY.year, use_rollups=False),
+    queries.monthly_counts(-1, TODAY.year),
+    queries.yearly_counts(-1, use_rollups=False),
+    queries.yearly_counts(-1),
+    queries.diary_entries_before(-1, TODAY - datetime.timedelta(days=100), 50),
+    queries.search_diary(-1, 'dinner', 20),
+], ids=['day', 'month', 'export', 'year-aggregate', 'year-rollups', 'diary-aggregate', 'diary-rollups', 'timeline',
+        'search'])
+def test_diary_queries_use_indexes(conn, query):
+    node_types = [node['Node Type'] for node in explain(conn, query)]
+
+    assert 'Seq Scan' not in node_types
+    assert 'BitmapAnd' not in node_types
+
+
+@pytest.mark.parametrize('before', [None, (TODAY - datetime.timedelta(days=100), -2)], ids=['first-page', 'older-page'])
+def test_family_feed_pulls_a_page_per_owner(conn, before):
+    nodes = explain(conn, queries.family_feed(GUEST_ID, before, 50))
+    node_types = [node['Node Type'] for node in nodes]
+    assert 'Seq Scan' not in node_types
+
+    # the pulled entries are read by a limited index scan for each owner, never sorted all together
+    entry_scans = [node for node in nodes if node.get('Relation Name') == 'diary_entries']
+    assert [node['Node Type'] for node in entry_scans] == ['Index Scan']
+    assert entry_scans[0]['Scan Direction'] == 'Backward'
+    limits = [node for node in nodes if node['Node Type'] == 'Limit' and entry_scans[0] in node['Plans']]
+    assert limits and limits[0]['Parent Relationship'] == 'Inner'
@@ -0,0 +1,16 @@
+import pytest
+
+pytest.importorskip('sqlalchemy')
+
+from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2  # noqa: E402
+
+from app import statements  # noqa: E402
+
+
+def test_statements_compile_to_named_placeholders():
+    statements.compile_statements(PGDialect_psycopg2())
+
+    assert all(statement.sql for statement in statements.STATEMENTS)
+    assert '%(user_id)s' in statements.diary_entry.sql
+    assert '%(date)s' in statements.diary_entry.sql
+    assert statements.diary_entry.params(user_id=1, date='2017-01-01') == {'user_id': 1, 'date': '2017-01-01'}
@@ -0,0 +1,31 @@
+from app.throttle import LoginThrottle, TokenBuckets
+
+
+def test_token_buckets_refill(timer):
+    buckets = TokenBuckets(rate=60, burst=2, timer=timer)
+
+    assert buckets.consume('1.2.3.4')
+    assert buckets.consume('1.2.3.4')
+    assert not buckets.consume('1.2.3.4')
+    assert buckets.consume('5.6.7.8')
+
+    timer.now = 1
+    assert buckets.consume('1.2.3.4')
+    assert buckets.stats() == {'keys': 2, 'allowed': 4, 'rejected': 1}
+
+
+def test_token_buckets_evict_refilled_keys(timer):
+    buckets = TokenBuckets(rate=60, burst=2, sweep_interval=10, timer=timer)
+    buckets.consume('1.2.3.4')
+
+    timer.now = 10
+    buckets.consume('5.6.7.8')
+
+    assert len(buckets) == 1
+
+
+def test_login_throttle_limits_email_across_ips():
+    throttle = LoginThrottle(ip_rate=60, ip_burst=10, email_rate=1, email_burst=1)
+
+    assert throttle.allow('1.2.3.4', 'Max@example.com')
+    assert not throttle.allow('5.6.7.8', 'max@example.com ')
@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('aiohttp')
+pytest.importorskip('sqlalchemy')
+
+from app.settings import Settings  # noqa: E402
+from app.user import LocalSessionStore, create_session_store  # noqa: E402
+
+
+def test_local_session_store_sweeps_expired_sessions(timer):
+    loop = asyncio.new_event_loop()
+    store = LocalSessionStore(maxsize=10, ttl=60, timer=timer)
+
+    loop.run_until_complete(store.set(('a', '127.0.0.1'), 1))
+    timer.now = 30
+    loop.run_until_complete(store.set(('b', '127.0.0.1'), 2))
+    timer.now = 60
+
+    assert loop.run_until_complete(store.sweep()) == 1
+    assert loop.run_until_complete(store.get(('b', '127.0.0.1'))) == 2
+    loop.run_until_complete(store.delete(('b', '127.0.0.1')))
+    assert loop.run_until_complete(store.get(('b', '127.0.0.1'))) is None
+    loop.close()
+
+
+def test_create_session_store_rejects_unknown_backend():
+    with pytest.raises(RuntimeError):
+        create_session_store(Settings(DB_PASSWORD='', SESSION_STORE_BACKEND='nope'))